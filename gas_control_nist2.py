@@ -9,20 +9,26 @@ Notes:
 By Jorge Moncada Vivas and contributions of Ryuichi Shimogawa
 """
 
+import functools
+import math
+import operator
 import os
+import queue
+import re
+import sys
+import threading
 import time
-import serial
-from serial.tools import list_ports
-import time
-from datetime import datetime
-
-import propar
-import minimalmodbus
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as futures_wait
+from types import MappingProxyType
 
 
 # The HID for the valve 3. This is should ideally be a specified in a different file.
 # HID_VALVE = "USB VID:PID=067B:2303 SER= LOCATION=1-11" #RS232
 HID_VALVE = "COM10" #RS485
+BAUD_VALVES = 9600
 HID_MFC = "COM9"
 BAUD_MFC = 38400
 HID_TMP = "COM8"
@@ -32,8 +38,273 @@ SUB_ADD_TMP = 2
 VALVE_POSITION = {"A": 0, "B": 1, "Unknown": 1, "pulse": 0, "cont": 1, "mix": 1}
 VALVE_ID = {"A": 1, "B": 2, "C": 3, "D": 4, "E": 5, "F": 6, "G": 7, "H": 8, "I": 9}
 
+# Serial commands of the valve controller precomputed for each valve
+# CP queries the position, CC moves the valve to position B (ON) and CW to position A (OFF)
+_CP_CMD, _CC_CMD, _CW_CMD = (
+    {valve: "/{}{}\r".format(valve, command).encode() for valve in VALVE_ID}
+    for command in ("CP", "CC", "CW")
+)
+# Position reported by the valve controller and commands that move the valves to it
+# The replies are parsed as bytes, the positions are single byte slices of the frame
+_MOVE_CMD = {"ON": (b"B", _CC_CMD), "OFF": (b"A", _CW_CMD)}
+_POS_DECODE = {b"A": "OFF", b"B": "ON"}
+
+# Parameters of the gases fed by the Flow-SMS mass flow controllers, one row per gas:
+# (gas, node ID, calibration ID, flow range in sccm, calibration factor, float to int factor)
+_GAS_TABLE = (
+    ("H2_A", 4, 0, (0.6, 30.0), 1.0, 30),
+    ("H2_B", 13, 0, (0.6, 30.0), 1.0, 30),
+    ("D2_A", 4, 1, (0.6, 30.0), 1.0, 30),
+    ("D2_B", 13, 1, (0.6, 30.0), 1.0, 30),
+    ("O2_A", 5, 0, (0.6, 30.0), 1.0, 30),
+    ("O2_B", 12, 0, (0.6, 30.0), 1.0, 30),
+    ("CO_AH", 6, 0, (0.6, 30.0), 1.0, 30),
+    ("CO_AL", 6, 3, (0.36, 18.0), 1.0, 18),
+    ("CO_BH", 11, 0, (0.6, 30.0), 1.0, 30),
+    ("CO_BL", 11, 3, (0.36, 18.0), 1.0, 18),
+    ("CO2_AH", 6, 1, (0.6, 30.0), 1.0, 30),
+    ("CO2_AL", 6, 2, (0.26, 13.0), 1.0, 13),
+    ("CO2_BH", 11, 1, (0.6, 30.0), 1.0, 30),
+    ("CO2_BL", 11, 2, (0.26, 13.0), 1.0, 13),
+    ("CH4_A", 7, 0, (0.6, 30.0), 1.0, 30),
+    ("CH4_B", 10, 0, (0.6, 30.0), 1.0, 30),
+    ("C2H6_A", 7, 1, (0.6, 30.0), 1.0, 30),
+    ("C2H6_B", 10, 1, (0.6, 30.0), 1.0, 30),
+    ("C3H8_A", 7, 2, (0.6, 30.0), 1.0, 30),
+    ("C3H8_B", 10, 2, (0.6, 30.0), 1.0, 30),
+    ("He_A", 8, 0, (1.2, 60.0), 1.0, 60),
+    ("He_B", 9, 0, (1.2, 60.0), 1.0, 60),
+    ("Ar_A", 8, 1, (1.2, 60.0), 1.0, 60),
+    ("Ar_B", 9, 1, (1.2, 60.0), 1.0, 60),
+    ("N2_A", 8, 2, (1.2, 60.0), 1.0, 60),
+    ("N2_B", 9, 2, (1.2, 60.0), 1.0, 60),
+)
+# Read-only lookups by gas name built once from _GAS_TABLE and shared by all the GasControl instances
+_GAS_IDX = MappingProxyType({row[0]: i for i, row in enumerate(_GAS_TABLE)})
+_GAS_ID = MappingProxyType({row[0]: row[1] for row in _GAS_TABLE})
+_GAS_CAL = MappingProxyType({row[0]: row[2] for row in _GAS_TABLE})
+_GAS_FLOW_RANGE = MappingProxyType({row[0]: row[3] for row in _GAS_TABLE})
+_GAS_CALIBRATION_FACTOR = MappingProxyType({row[0]: row[4] for row in _GAS_TABLE})
+_GAS_FLOAT_TO_INT_FACTOR = MappingProxyType({row[0]: row[5] for row in _GAS_TABLE})
+# Setpoint counts per sccm, the Flow-SMS setpoint is 32000 at the full scale (float to int factor)
+_GAS_SCALE_CONST = MappingProxyType({row[0]: 32000.0 / row[5] for row in _GAS_TABLE})
+
+# Everything set_flowrate needs for one gas, looked up with a single key
+GasEntry = namedtuple("GasEntry", "lo hi cal_factor float_to_int node cal feed_fn")
+
+# Live display of the event loops. Every line of a tick is cleared before it is written and the cursor
+# is moved back up to the first line once at the end, so that the next tick repaints the block in place
+_SEP = "-" * 101
+_CLEAR_LINE = "\r\033[K"
+# One tick of the heating and cooling events, filled with
+# (pressure A, pressure B, setpoint, programmer temperature, reactor temperature, power out)
+_TICK_FMT = "".join(
+    _CLEAR_LINE + line + "\n"
+    for line in (
+        _SEP,
+        "Pressure in line A: %.2f psia",
+        "Pressure in line B: %.2f psia",
+        "Setpoint Temp: %s C | Programmer Temp: %s C | Reactor Temp: %s C | Power out: %s%%",
+        _SEP,
+    )
+) + "\033[5A"
+# One tick of time_event, filled with (pressure A, pressure B, label of the wait, elapsed seconds)
+_ELAPSED_FMT = "".join(
+    _CLEAR_LINE + line + "\n"
+    for line in (
+        _SEP,
+        "Pressure in line A: %.2f psia",
+        "Pressure in line B: %.2f psia",
+        "Elapsed time for %s: %d seconds",
+        _SEP,
+    )
+) + "\033[5A"
+# Erases the block from the cursor down, written before the final message of an event loop
+_CLEAR_BLOCK = "\r\033[J"
+
+# Format of the date and time printed by the remote triggers
+_TS_FMT = "%m/%d/%Y %H:%M:%S"
+
+# Node IDs of the Flow-SMS pressure controllers of gas lines A and B
+_PRESSURE_NODES = (3, 14)
+
+# Gases that share a Flow-SMS node, in the order flowsms_setpoints sets the nodes
+# Only the first gas of a group with a positive flow is set, otherwise the last gas of the group
+# is written so that the node is zeroed
+_SETPOINT_GROUPS = (
+    ("CO_AH", "CO_AL", "CO2_AH", "CO2_AL"),
+    ("CO_BH", "CO_BL", "CO2_BH", "CO2_BL"),
+    ("CH4_A", "C2H6_A", "C3H8_A"),
+    ("CH4_B", "C2H6_B", "C3H8_B"),
+    ("H2_A", "D2_A"),
+    ("H2_B", "D2_B"),
+    ("He_A", "Ar_A", "N2_A"),
+    ("He_B", "Ar_B", "N2_B"),
+)
+# Gases with a node of their own, flowsms_setpoints closes them when no flow is given for them unless
+# their last acknowledged setpoint is already zero
+_OPTIONAL_SETPOINTS = ("O2_A", "O2_B")
+
+# Gas paths of the dual loop pulse modes, (valve position off, valve position on) keyed by the pulsed loop
+_LOOP_PULSE_PATHS = {
+    "A": (
+        "Valve Position Off: Gas Line B -> loop 2 -> reactor /// Gas Line A -> loop 1 -> vent",
+        "Valve Position On: Gas line B -> loop 1 -> reactor /// Gas Line A -> loop 2 -> vent",
+    ),
+    "B": (
+        "Valve Position Off: Gas Line A -> loop 2 -> reactor /// Gas Line B -> loop 1 -> vent",
+        "Valve Position On: Gas Line A -> loop 1 -> reactor /// Gas Line B -> loop 2 -> vent",
+    ),
+}
+
+# Fluid names of the calibration IDs read from the Flow-SMS, indexed by calibration ID
+_H2_D2_A_NAMES = ("H2_A", "D2_A")
+_H2_D2_B_NAMES = ("H2_B", "D2_B")
+_CO_CO2_A_NAMES = ("CO_AH", "CO2_AH", "CO2_AL", "CO_AL")
+_CO_CO2_B_NAMES = ("CO_BH", "CO2_BH", "CO2_BL", "CO_BL")
+_HC_A_NAMES = ("CH4_A", "C2H6_A", "C3H8_A")
+_HC_B_NAMES = ("CH4_B", "C2H6_B", "C3H8_B")
+_CARRIER_NAMES = ("He", "Ar", "N2")
+
+
+def _fluid_name(names, calibration_id):
+    """Returns the fluid name of a calibration ID read from a Flow-SMS, or the ID itself if it is unknown"""
+    index = int(float(calibration_id))
+    return names[index] if 0 <= index < len(names) else calibration_id
+
+
+def _percentages(flows):
+    """Returns the total of the flows of a gas line and the share of each flow in %, all 0.0 when there is no flow"""
+    total = sum(flows)
+    if total == 0:
+        return total, [0.0] * len(flows)
+    return total, [flow / total * 100 for flow in flows]
+
+
+def _wait_tick(tick, period=1.0):
+    """Sleeps until tick and returns the next tick of a fixed period grid on the monotonic clock
+    The loops using it do not drift, ticks missed by a slow iteration are skipped instead of run in a burst
+    """
+    now = time.monotonic()
+    if tick > now:
+        time.sleep(tick - now)
+        return tick + period
+    return tick + period * (math.floor((now - tick) / period) + 1)
+
+
+def _print_loop_pulse_banner(loop, pulses, time_bp):
+    """Prints the operation mode and the gas paths of a dual loop pulse train on gas line loop"""
+    print('Valves operation mode: pulses (dual loop alternation)')
+    print('Number of pulses (loop): {}\nTime in between pulses (s): {}'.format(pulses,time_bp))
+    for path in _LOOP_PULSE_PATHS[loop]:
+        print(path)
+
+
+def _pulse_schedule(int_pulses, period):
+    """Yields the number of each pulse, its start time relative to the start of the train and
+    whether its status message is printed
+    The pulses are scheduled from the start of the train so the sleep jitter does not accumulate,
+    the status message is printed at most every 50 ms because printing is slow compared to short pulses
+    """
+    print_every = max(1, math.ceil(0.05 / period)) if period > 0 else int_pulses
+    for pulse in range(1, int_pulses + 1):
+        yield pulse, (pulse - 1) * period, pulse % print_every == 0 or pulse == int_pulses
+
+
+def _print_pulse_status(pulse, int_pulses):
+    """Overwrites the pulse status message in the terminal window"""
+    print('Sending pulse number {} of {}'.format(pulse,int_pulses), end = "\r")
+
+
+def _wait_result(future, poll=0.1):
+    """Returns the result of a future, waiting for it in short timed waits
+    An untimed wait on a lock cannot be interrupted by Ctrl-C on Windows (before Python 3.14)
+    """
+    while True:
+        try:
+            return future.result(timeout=poll)
+        except FutureTimeoutError:
+            # A job that failed with TimeoutError itself is done, its exception is passed on
+            if future.done():
+                raise
+
+
+def _write_stdout(text):
+    """Writes text to the terminal with a single write() system call
+    Falls back to sys.stdout when it is not backed by a file descriptor (e.g. in Jupyter)
+    """
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, OSError, ValueError):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+    # Text already printed through sys.stdout has to reach the terminal first
+    sys.stdout.flush()
+    data = text.encode()
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _with_retry(max_tries=5, base_delay=0.05, max_delay=1.0, exceptions=(IOError, ValueError)):
+    """Decorator that retries an instrument request failing with one of exceptions
+    The delay between attempts doubles from base_delay up to max_delay, the last exception is raised after max_tries attempts
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_tries):
+                try:
+                    return function(*args, **kwargs)
+                except exceptions:
+                    if attempt == max_tries - 1:
+                        raise
+                    time.sleep(min(base_delay * 2**attempt, max_delay))
+
+        return wrapper
+
+    return decorator
+
 
 class GasControl:
+    # Every instance attribute has to be declared here
+    __slots__ = (
+        "status",
+        "_all_ports",
+        "valves_hid",
+        "valves_comport",
+        "valves_baud",
+        "ser",
+        "_cmd_q",
+        "_stop_pulses",
+        "_serial_thread",
+        "mfc_hid",
+        "mfc_comport",
+        "_propar",
+        "mfc_master",
+        "_setpoint_cache",
+        "gas_list",
+        "gas_set",
+        "gas_dict",
+        "gas_ID",
+        "gas_cal",
+        "gas_flow_range",
+        "calibration_factor",
+        "gas_float_to_int_factor",
+        "gas_scale_const",
+        "feed_gas_functions",
+        "gas_info",
+        "tmp_hid",
+        "tmp_comport",
+        "sub_address_tmp",
+        "_serial",
+        "tmp_master",
+        "_io",
+        "_tmp_lock",
+        "_reg376_cache",
+    )
+
     def __init__(
         self,
         valves_hid: str = HID_VALVE,
@@ -45,6 +316,7 @@ class GasControl:
         tmp_hid: str = HID_TMP,
         tmp_comport: str = None,
         sub_address_tmp: int = SUB_ADD_TMP,
+        valves_baud: int = BAUD_VALVES,
     ) -> None:
         """Initialize the valve control device
         You can specify the HID or the comport of the valve control device
@@ -58,116 +330,122 @@ class GasControl:
             mfc_comport (str): Comport of the mfc device [default: None]
             tmp_hid (str): HID of the temperature controller device, you can also specify the name or hid of the comport [default: HID_TMP]
             tmp_comport (str): Comport of the temperature controller device [default: None]
+            valves_baud (int): Baud rate of the valve control device [default: BAUD_VALVES]
         """
 
-        self.status: list[str] = [None] * num_valves
+        # Last known position of each valve, None when it is unknown
+        self.status: dict[str, str] = {valve: None for valve in list(VALVE_ID)[:num_valves]}
+
+        # Enumerating the comports is slow on Windows, it is done once and shared by _resolve_comport
+        from serial.tools import list_ports
+
+        self._all_ports = list(list_ports.comports())
 
         self.valves_hid: str = valves_hid
         self.valves_comport: str = valves_comport
-        self.init_valves_comport()
+        self.valves_baud: int = valves_baud
+        self.valves_comport = self._resolve_comport(self.valves_hid, self.valves_comport, "valves")
         print("Valve comport: {}".format(self.valves_comport))
         self.serial_connection_valves()
+        # The valve serial port is owned by a worker thread, the valve commands are queued to it
+        self._cmd_q = queue.Queue()
+        self._stop_pulses = threading.Event()
+        self._serial_thread = threading.Thread(target=self._serial_worker, daemon=True)
+        self._serial_thread.start()
+        self.get_all_valve_positions()
 
         self.mfc_hid: str = mfc_hid
         self.mfc_comport: str = mfc_comport
-        self.init_mfc_comport()
+        self.mfc_comport = self._resolve_comport(self.mfc_hid, self.mfc_comport, "mfc")
         print("MFC comport: {}".format(self.mfc_comport))
+        # propar and minimalmodbus are slow to import, they are only loaded when a GasControl is created
+        import propar
+
+        # Kept on the instance, the batched reads and writes use it on every call
+        self._propar = propar
         self.mfc_master = propar.master(self.mfc_comport, 38400)
+        # Last setpoint (counts) acknowledged by each Flow-SMS node, a node is missing while its setpoint is unknown
+        self._setpoint_cache = {}
         self.define_flowsms()
 
         self.tmp_hid: str = tmp_hid
         self.tmp_comport: str = tmp_comport
         self.sub_address_tmp: int = sub_address_tmp
-        self.init_tmp_comport()
+        self.tmp_comport = self._resolve_comport(self.tmp_hid, self.tmp_comport, "tmp")
         print("TMP comport: {}".format(self.tmp_comport))
-        self.tmp_master = minimalmodbus.Instrument(self.tmp_comport, self.sub_address_tmp)
-
-    def init_valves_comport(self):
-        """Initialize the comport of the valve control device
-        It will print the available comports if no comport is specified
-        """
-
-        if self.valves_hid:
-            valves_port = list_ports.grep(self.valves_hid)
-            valves_port = list(valves_port)
+        import minimalmodbus
+        import serial
 
-            if (len(valves_port) == 0) and (self.valves_comport is None):
-                self.print_available_comports()
-
-                raise ValueError(
-                    "No comport found for valves_hid: {}".format(self.valves_hid)
-                )
-            elif len(valves_port) == 1:
-                self.valves_comport = valves_port[0].device
-            else:
-                self.print_available_comports()
-                raise ValueError(
-                    "Multiple comports found for valves_hid: {}".format(
-                        self.valves_hid
-                    )
-                )
+        # Kept on the instance, _safe_read catches serial.SerialException on every read
+        self._serial = serial
+        self.tmp_master = minimalmodbus.Instrument(self.tmp_comport, self.sub_address_tmp)
+        # The port stays open for the lifetime of the GasControl, it is only reopened by _safe_read when it is lost
+        self.tmp_master.close_port_after_each_call = False
+        self._enable_nodelay()
+        # Worker thread for the Modbus reads that can overlap with other I/O (e.g. the Flow-SMS reads of _ramp)
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modbus")
+        # Held around every use of tmp_master, the worker and the caller's thread never share the port at the same time
+        self._tmp_lock = threading.RLock()
+        # Last value written to the logic A trigger register (376), None until the first write
+        self._reg376_cache = None
+
+    def _resolve_comport(self, hid, comport, label):
+        """Resolves the comport of a device from its HID
+        It will print the available comports if the comport cannot be resolved
 
-        if self.valves_comport is None:
-            self.print_available_comports()
-            raise ValueError("No comport specified")
+        Args:
+            hid (str): HID of the device, you can also specify the name or hid of the comport
+            comport (str): Comport of the device, used when no comport matches the HID
+            label (str): Name of the device used in the error messages (valves, mfc or tmp)
 
-    def init_mfc_comport(self):
-        """Initialize the comport of the mfc device
-        It will print the available comports if no comport is specified
+        Returns:
+            str: Comport of the device
         """
 
-        if self.mfc_hid:
-            mfc_port = list_ports.grep(self.mfc_hid)
-            mfc_port = list(mfc_port)
+        if hid:
+            ports = self._grep_comports(hid)
 
-            if (len(mfc_port) == 0) and (self.mfc_comport is None):
+            if (len(ports) == 0) and (comport is None):
                 self.print_available_comports()
 
                 raise ValueError(
-                    "No comport found for mfc_hid: {}".format(self.mfc_hid)
+                    "No comport found for {}_hid: {}".format(label, hid)
                 )
-            elif len(mfc_port) == 1:
-                self.mfc_comport = mfc_port[0].device
+            elif len(ports) == 1:
+                comport = ports[0].device
             else:
                 self.print_available_comports()
                 raise ValueError(
-                    "Multiple comports found for mfc_hid: {}".format(self.mfc_hid)
+                    "Multiple comports found for {}_hid: {}".format(label, hid)
                 )
 
-        if self.mfc_comport is None:
+        if comport is None:
             self.print_available_comports()
             raise ValueError("No comport specified")
-        
-    def init_tmp_comport(self):
-        """Initialize the comport of the tmp device
-        It will print the available comports if no comport is specified
-        """
 
-        if self.tmp_hid:
-            tmp_port = list_ports.grep(self.tmp_hid)
-            tmp_port = list(tmp_port)
+        return comport
 
-            if (len(tmp_port) == 0) and (self.tmp_comport is None):
-                self.print_available_comports()
+    def _grep_comports(self, regexp):
+        """Searches the comports enumerated at initialization, same matching as list_ports.grep
 
-                raise ValueError(
-                    "No comport found for tmp_hid: {}".format(self.tmp_hid)
-                )
-            elif len(tmp_port) == 1:
-                self.tmp_comport = tmp_port[0].device
-            else:
-                self.print_available_comports()
-                raise ValueError(
-                    "Multiple comports found for tmp_hid: {}".format(self.tmp_hid)
-                )
+        Args:
+            regexp (str): Regular expression matched against the name, description and hardware id of the comports
 
-        if self.tmp_comport is None:
-            self.print_available_comports()
-            raise ValueError("No comport specified")
+        Returns:
+            list: Matching comports
+        """
+        pattern = re.compile(regexp, re.I)
+        return [
+            comport
+            for comport in self._all_ports
+            if pattern.search(comport.device)
+            or pattern.search(comport.description)
+            or pattern.search(comport.hwid)
+        ]
 
     def print_available_comports(self):
         """Prints the available comports along with their description and hardware id"""
-        comports_available = list_ports.comports()
+        comports_available = self._all_ports
         print("Available comports:")
         for comport in comports_available:
             print(
@@ -178,61 +456,281 @@ class GasControl:
         """Function that establishes the serial connection with the valve controller
         It will connect to the comport specified in self.control_comport
         """
-        self.ser = serial.Serial()
-        self.ser.baudrate = 9600
-        self.ser.port = self.valves_comport
-        parity = serial.PARITY_NONE
-        stopbits = serial.STOPBITS_ONE
-        bytesize = serial.EIGHTBITS
-
-        if self.ser.isOpen() == False:
-            self.ser.timeout = 0.1
-            self.ser.open()
+        import serial
+
+        # The port is opened by the constructor, the timeout is only an upper bound: read_until
+        # returns as soon as the '\r' frame terminator arrives
+        self.ser = serial.Serial(
+            port=self.valves_comport,
+            baudrate=self.valves_baud,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=0.2,
+            xonxoff=False,
+            rtscts=False,
+            dsrdtr=False,
+        )
+        self._set_low_latency()
+
+    def set_controller_baud(self, new_baud: int):
+        """Changes the baud rate of the valve actuators and switches the comport to the new rate
+        Each actuator receives the SB (set baud rate) command, check in the actuator manual that
+        the rate is supported (4800 to 115200 baud for the VICI universal actuators).
+        The rate can also be changed on the actuators themselves (DIP switches or front panel),
+        in that case just pass the new rate as valves_baud when creating the GasControl
+
+        Args:
+            new_baud (int): New baud rate
+        """
+        new_baud = int(new_baud)
+        _wait_result(self._submit_serial(self._set_controller_baud, new_baud))
+        self.valves_baud = new_baud
+        print("Valves baud rate: {}".format(new_baud))
+
+    def _set_controller_baud(self, new_baud):
+        old_baud = self.ser.baudrate
+        self.ser.write(b''.join('/{}SB{}\r'.format(valve, new_baud).encode() for valve in self.status))
+        self.ser.flush()
+        # pyserial applies the new rate to the open port, no need to reopen it
+        self.ser.baudrate = new_baud
+        self.ser.reset_input_buffer()
+        if not self._read_all_valve_positions():
+            # The new rate is not confirmed, the port goes back to the rate of self.valves_baud
+            self.ser.baudrate = old_baud
+            self.ser.reset_input_buffer()
+            raise IOError("No valve answered at {} baud".format(new_baud))
+
+    def _set_low_latency(self):
+        """Sets the ASYNC_LOW_LATENCY flag of the valve comport
+        USB serial converters (FTDI) otherwise buffer the received bytes up to 16 ms before
+        delivering them. pyserial only supports this on Linux, on Windows the latency timer
+        is set in the advanced port settings of the driver
+        """
+        set_low_latency_mode = getattr(self.ser, "set_low_latency_mode", None)
+        if set_low_latency_mode is None:
+            return
+        try:
+            set_low_latency_mode(True)
+        except (AttributeError, IOError, ValueError):
+            # Not every platform and serial driver supports TIOCSSERIAL
+            pass
+
+    def _enable_nodelay(self):
+        """Disables Nagle's algorithm when the temperature controller is reached over TCP
+        Small Modbus requests are otherwise delayed up to 40 ms waiting for an ACK. minimalmodbus talks
+        over a serial port, so this only applies when the port is a TCP socket (e.g. a socket:// serial URL)
+        """
+        sock = getattr(self.tmp_master.serial, "_socket", None)
+        if sock is None:
+            return
+        import socket
+
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            # Not a TCP socket
+            pass
+
+    def _read_frame(self):
+        """Reads one '\r' terminated frame from the valve controller
+
+        Returns:
+            bytes: Frame without the terminator and surrounding whitespace
+        """
+        return self.ser.read_until(b'\r').strip()
+
+    def _serial_worker(self):
+        """Executes the jobs queued for the valve controller one at a time
+        This thread is the only one using self.ser once the GasControl is initialized
+        """
+        while True:
+            future, function, args = self._cmd_q.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args))
+            except BaseException as error:
+                future.set_exception(error)
+
+    def _submit_serial(self, function, *args):
+        """Queues a job for the valve controller serial worker
+
+        Args:
+            function (callable): Job to execute, it can use self.ser
+            *args: Arguments of the job
+
+        Returns:
+            Future: Future holding the return value of the job
+        """
+        future = Future()
+        if threading.current_thread() is self._serial_thread:
+            # Jobs that queue other jobs would deadlock the worker, run them inline
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function(*args))
+            except BaseException as error:
+                future.set_exception(error)
         else:
-            print("The Port is closed: " + self.ser.portstr)
+            self._cmd_q.put((future, function, args))
+        return future
 
     def get_valve_position(self, valve):
-        self.ser.write('/{}CP\r'.format(valve).encode())
-        current_position = self.ser.readline().decode('utf-8').strip()
-        valve_no = current_position[1]
-        position = current_position[-2]
-        if position == 'A':
-            return valve_no, 'OFF'
-        elif position == 'B':
-            return valve_no, 'ON'
-        else:
-            return valve_no, 'Unknown'
-        
+        return _wait_result(self._submit_serial(self._read_valve_position, valve))
+
+    def _read_valve_position(self, valve):
+        # A late reply to an earlier query would be read as the answer to this one
+        self.ser.reset_input_buffer()
+        self.ser.write(_CP_CMD[valve])
+        frame = self._read_frame()
+        # Only a reply echoing the queried valve ID is trusted
+        self.status[valve] = _POS_DECODE.get(frame[-2:-1]) if frame[1:2] == valve.encode() else None
+        return valve, self.status[valve] or 'Unknown'
+
+    def get_all_valve_positions(self):
+        """Queries the position of all the valves in a single pass over the bus
+        All the CP queries are written back-to-back and the responses are matched
+        to their valve by the echoed valve ID
+
+        Returns:
+            dict: Position of each valve ('ON', 'OFF' or 'Unknown') keyed by valve ID
+        """
+        return _wait_result(self._submit_serial(self._read_all_valve_positions))
+
+    def _read_all_valve_positions(self):
+        # Only the num_valves valves of self.status are connected, the others would never answer
+        return self._query_positions(b"".join(_CP_CMD[valve] for valve in self.status), len(self.status))
+
+    def _query_positions(self, query, count):
+        """Writes several pipelined CP queries and reads their replies
+
+        Args:
+            query (bytes): Concatenated CP queries
+            count (int): Number of queries in query
+
+        Returns:
+            dict: Position of each valve ('ON', 'OFF' or 'Unknown') keyed by valve ID
+        """
+        # A late reply to an earlier query would take the place of one of these replies
+        self.ser.reset_input_buffer()
+        self.ser.write(query)
+        positions = {}
+        for _ in range(count):
+            frame = self._read_frame()
+            if len(frame) < 2:
+                continue
+            valve_no = chr(frame[1])
+            self.status[valve_no] = _POS_DECODE.get(frame[-2:-1])
+            positions[valve_no] = self.status[valve_no] or 'Unknown'
+        return positions
+
     def display_valve_positions(self, valve=None):
         if valve is not None:
             valve_no, position = self.get_valve_position(valve)
             print('Valve "{}" position is {}'.format(valve_no, position))
         else:
-            valves = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I']
-            positions = [self.get_valve_position(valve) for valve in valves]
-            for valve_no, position in positions:
-                print('Valve "{}" position is {}'.format(valve_no, position))
-
-    def move_valve_to_position(self, valve, position):
-        if position == 'ON':
-            position_real = 'B'
-            command = 'CC'
-        elif position == 'OFF':
-            position_real = 'A'
-            command = 'CW'
-        else:
+            positions = self.get_all_valve_positions()
+            for valve_no in VALVE_ID:
+                print('Valve "{}" position is {}'.format(valve_no, positions.get(valve_no, 'Unknown')))
+
+    def _wait_for_position(self, valve, position_real, deadline, interval=0.02):
+        """Polls the position of a valve until it matches the requested one
+
+        Args:
+            valve (str): Valve ID
+            position_real (bytes): Position reported by the valve controller, b"A" or b"B"
+            deadline (float): time.monotonic() value after which the polling is abandoned
+            interval (float): Time in seconds between position queries [default: 0.02]
+
+        Returns:
+            bool: True if the valve reached the position before the deadline
+        """
+        echo = valve.encode()
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            # A late reply to an earlier query would be read as the answer to this one
+            self.ser.reset_input_buffer()
+            self.ser.write(_CP_CMD[valve])
+            frame = self._read_frame()
+            # Only a reply echoing the queried valve ID is trusted
+            if frame[1:2] == echo and frame[-2:-1] == position_real:
+                return True
+        return False
+
+    def move_valve_to_position_async(self, valve, position, timeout=0.5):
+        """Queues a valve move and returns without waiting for the valve to settle
+
+        Args:
+            valve (str): Valve ID
+            position (str): Position of the valve, can be "ON" or "OFF"
+            timeout (float): Maximum time in seconds to wait for the valve to settle [default: 0.5]
+
+        Returns:
+            Future: Future that is done once the valve has been moved
+        """
+        return self._submit_serial(self._move_valve, valve, position, timeout)
+
+    def move_valve_to_position(self, valve, position, timeout=0.5):
+        """Moves a valve to the requested position and waits until the controller reports it
+
+        Args:
+            valve (str): Valve ID
+            position (str): Position of the valve, can be "ON" or "OFF"
+            timeout (float): Maximum time in seconds to wait for the valve to settle [default: 0.5]
+
+        Returns:
+            bool: True if the controller reports the valve in the requested position
+        """
+        return _wait_result(self.move_valve_to_position_async(valve, position, timeout))
+
+    def _move_valve(self, valve, position, timeout, attempts=2):
+        if position not in _MOVE_CMD:
             print('Invalid position specified.')
-            return        
-        self.ser.write('/{}{}\r'.format(valve, command).encode())
-        time.sleep(0.3)
-        self.ser.write('/{}CP\r'.format(valve).encode())
-        new_position = self.ser.readline().decode('utf-8').strip()[-2]
-        if new_position != position_real:
-            self.ser.write('/{}{}\r'.format(valve, command).encode())
-        else:
-            # print('Valve "{}" successfully moved to position {}'.format(valve, position))
-            pass
-    
+            return False
+        if self.status.get(valve) == position:
+            return True
+        position_real, command = _MOVE_CMD[position]
+        # Every attempt is verified, a command re-issued on timeout is checked like the first one
+        for _ in range(attempts):
+            self.ser.write(command[valve])
+            if self._wait_for_position(valve, position_real, time.monotonic() + timeout):
+                self.status[valve] = position
+                return True
+        self.status[valve] = None
+        print('Valve "{}" did not reach position {}'.format(valve, position))
+        return False
+
+    def _apply_mode(self, commands, timeout=0.5):
+        """Moves several valves at once
+        All the commands are issued before polling, so the valves actuate in parallel
+
+        Args:
+            commands (list[tuple[str, str]]): (valve, position) pairs, position can be "ON" or "OFF"
+            timeout (float): Maximum time in seconds to wait for the valves to settle [default: 0.5]
+
+        Returns:
+            bool: True if the controller reports all the valves in the requested positions
+        """
+        return _wait_result(self._submit_serial(self._move_valves, commands, timeout))
+
+    def _move_valves(self, commands, timeout, interval=0.02, attempts=2):
+        # Valves already in the requested position are not commanded again
+        targets = {valve: position for valve, position in commands if self.status.get(valve) != position}
+        for _ in range(attempts):
+            if not targets:
+                return True
+            # One write for all the commands and one batched CP query per poll
+            self.ser.write(b''.join(_MOVE_CMD[position][1][valve] for valve, position in targets.items()))
+            deadline = time.monotonic() + timeout
+            while targets and time.monotonic() < deadline:
+                time.sleep(interval)
+                positions = self._query_positions(b''.join(_CP_CMD[valve] for valve in targets), len(targets))
+                targets = {valve: position for valve, position in targets.items() if positions.get(valve) != position}
+        for valve, position in targets.items():
+            self.status[valve] = None
+            print('Valve "{}" did not reach position {}'.format(valve, position))
+        return not targets
+
     def carrier_He_A(self):
         """Fuction that selects He as carrier gas for the Gas Line A"""
         self.move_valve_to_position('G', 'OFF')
@@ -375,9 +873,7 @@ class GasControl:
         Args:
             verbose (bool): If True, prints the valve status [default: True]
         """
-        self.move_valve_to_position('A', 'OFF')
-        self.move_valve_to_position('B', 'OFF')
-        self.move_valve_to_position('C', 'OFF')
+        self._apply_mode([('A', 'OFF'), ('B', 'OFF'), ('C', 'OFF')])
         # self.ser.write(b"/ACW\r")
         # self.ser.write(b"/BCW\r")
         # self.ser.write(b"/CCW\r")
@@ -394,9 +890,7 @@ class GasControl:
         Args:
             verbose (bool): If True, prints the valve status [default: True]
         """
-        self.move_valve_to_position('A', 'OFF')
-        self.move_valve_to_position('B', 'ON')
-        self.move_valve_to_position('C', 'OFF')
+        self._apply_mode([('A', 'OFF'), ('B', 'ON'), ('C', 'OFF')])
         # self.ser.write(b"/ACW\r")
         # self.ser.write(b"/BCC\r")
         # self.ser.write(b"/CCW\r")
@@ -426,12 +920,17 @@ class GasControl:
     #         monitoring_interval (float): Time in seconds between each valve status check [default: 0.01]
     #         save_log (str): Path to the file where the valve status will be saved [default: "log.txt"]
     #     """
+    #     log_file = None
     #     if save_log is not None:
-    #         os.makedirs(os.path.dirname(save_log), exist_ok=True)
+    #         log_dir = os.path.dirname(save_log)
+    #         if log_dir and not os.path.isdir(log_dir):
+    #             os.makedirs(log_dir, exist_ok=True)
 
-    #         if not os.path.isfile(save_log):
-    #             with open(save_log, "w") as f:
-    #                 f.write("Time, Valve1\n")
+    #         # The log is opened once and line buffered, instead of reopened for every pulse
+    #         new_log = not os.path.isfile(save_log)
+    #         log_file = open(save_log, "a", buffering=1)
+    #         if new_log:
+    #             log_file.write("Time, Valve1\n")
 
     #     start_time = time.time()
     #     end_time = start_time + pulses * (time1 + time2)
@@ -466,52 +965,50 @@ class GasControl:
     #     else:
     #         valve_end_fun = self.cont_mode_dry
 
-    #     while True:
-    #         current_time = time.time()
-    #         accumulated_time = current_time - start_time
+    #     try:
+    #         while True:
+    #             current_time = time.time()
+    #             accumulated_time = current_time - start_time
 
-    #         current_pulse = int(accumulated_time / (time1 + time2))
-    #         current_time_in_pulse = accumulated_time - current_pulse * (time1 + time2)
+    #             current_pulse = int(accumulated_time / (time1 + time2))
+    #             current_time_in_pulse = accumulated_time - current_pulse * (time1 + time2)
 
-    #         if current_time_in_pulse < time1:
-    #             if VALVE_POSITION[self.status[0]] == start_gas_id:
-    #                 time.sleep(monitoring_interval)
-    #                 continue
-    #             else:
-    #                 self.get_status()
+    #             if current_time_in_pulse < time1:
     #                 if VALVE_POSITION[self.status[0]] == start_gas_id:
     #                     time.sleep(monitoring_interval)
     #                     continue
     #                 else:
-    #                     valve_fun1(verbose=False)
-    #                     if save_log is not None:
-    #                         self.get_status()
-    #                         with open(save_log, "a") as f:
-    #                             f.write(
-    #                                 f"{current_time}, {VALVE_POSITION[self.status[0]]}\n"
-    #                             )
-    #         else:
-    #             if VALVE_POSITION[self.status[0]] != start_gas_id:
-    #                 time.sleep(monitoring_interval)
-    #                 continue
+    #                     self.get_status()
+    #                     if VALVE_POSITION[self.status[0]] == start_gas_id:
+    #                         time.sleep(monitoring_interval)
+    #                         continue
+    #                     else:
+    #                         valve_fun1(verbose=False)
+    #                         if log_file is not None:
+    #                             self.get_status()
+    #                             log_file.write(f"{current_time}, {VALVE_POSITION[self.status[0]]}\n")
     #             else:
-    #                 self.get_status()
     #                 if VALVE_POSITION[self.status[0]] != start_gas_id:
     #                     time.sleep(monitoring_interval)
     #                     continue
     #                 else:
-    #                     valve_fun2(verbose=False)
-    #                     if save_log is not None:
-    #                         self.get_status()
-    #                         with open(save_log, "a") as f:
-    #                             f.write(
-    #                                 f"{current_time}, {VALVE_POSITION[self.status[0]]}\n"
-    #                             )
-
-    #         time.sleep(monitoring_interval)
-
-    #         if current_time > end_time:
-    #             break
+    #                     self.get_status()
+    #                     if VALVE_POSITION[self.status[0]] != start_gas_id:
+    #                         time.sleep(monitoring_interval)
+    #                         continue
+    #                     else:
+    #                         valve_fun2(verbose=False)
+    #                         if log_file is not None:
+    #                             self.get_status()
+    #                             log_file.write(f"{current_time}, {VALVE_POSITION[self.status[0]]}\n")
+
+    #             time.sleep(monitoring_interval)
+
+    #             if current_time > end_time:
+    #                 break
+    #     finally:
+    #         if log_file is not None:
+    #             log_file.close()
 
     #     valve_end_fun()
 
@@ -524,9 +1021,7 @@ class GasControl:
         Args:
             verbose (bool): If True, prints the valve status [default: True]
         """
-        self.move_valve_to_position('A', 'ON')
-        self.move_valve_to_position('B', 'OFF')
-        self.move_valve_to_position('C', 'ON')        
+        self._apply_mode([('A', 'ON'), ('B', 'OFF'), ('C', 'ON')])
         # self.ser.write(b"/ACC\r")
         # self.ser.write(b"/BCW\r")
         # self.ser.write(b"/CCC\r")
@@ -543,9 +1038,7 @@ class GasControl:
         Args:
             verbose (bool): If True, prints the valve status [default: True]
         """
-        self.move_valve_to_position('A', 'ON')
-        self.move_valve_to_position('B', 'ON')
-        self.move_valve_to_position('C', 'ON')        
+        self._apply_mode([('A', 'ON'), ('B', 'ON'), ('C', 'ON')])
         # self.ser.write(b"/ACC\r")
         # self.ser.write(b"/BCW\r")
         # self.ser.write(b"/CCC\r")
@@ -560,16 +1053,8 @@ class GasControl:
         self.pulses_loop_mode_A()
         int_pulses = int(pulses)
         float_time = float(time_bp)
-        print('Valves operation mode: pulses (dual loop alternation)')
-        print('Number of pulses (loop): {}\nTime in between pulses (s): {}'.format(pulses,time_bp))
-        print('Valve Position Off: Gas Line B -> loop 2 -> reactor /// Gas Line A -> loop 1 -> vent')
-        print('Valve Position On: Gas line B -> loop 1 -> reactor /// Gas Line A -> loop 2 -> vent')
-        for pulse in range(0, int_pulses):
-            # tmp.pulse_ON()
-            self.ser.write(b'/ATO\r') # Comand that executes the pulses valve actuation
-            print('Sending pulse number {} of {}'.format(pulse+1,int_pulses), end = "\r") # Pulse status message for terminal window
-            time.sleep(float_time) # Conversion of seconds to miliseconds
-            # tmp.pulse_OFF()
+        _print_loop_pulse_banner('A', pulses, time_bp)
+        self._send_pulse_train(self._pulse_train, int_pulses, float_time)
         print('Pulses have finished') # End of the pulses message
 
     def send_pulses_loop_B(self,pulses,time_bp):
@@ -579,17 +1064,98 @@ class GasControl:
         self.pulses_loop_mode_B()
         int_pulses = int(pulses)
         float_time = float(time_bp)
-        print('Valves operation mode: pulses (dual loop alternation)')
-        print('Number of pulses (loop): {}\nTime in between pulses (s): {}'.format(pulses,time_bp))
-        print('Valve Position Off: Gas Line A -> loop 2 -> reactor /// Gas Line B -> loop 1 -> vent')
-        print('Valve Position On: Gas Line A -> loop 1 -> reactor /// Gas Line B -> loop 2 -> vent')
-        for pulse in range(0, int_pulses):
+        _print_loop_pulse_banner('B', pulses, time_bp)
+        self._send_pulse_train(self._pulse_train, int_pulses, float_time)
+        print('Pulses have finished') # End of the pulses message
+
+    async def send_pulses_loop_A_async(self, pulses, time_bp):
+        """Coroutine version of send_pulses_loop_A
+        Other tasks of the event loop (MFC reads, logging...) keep running in between the pulses
+
+        Args:
+            pulses (int): Number of pulses
+            time_bp (float): Time in seconds between pulses
+        """
+        import asyncio
+
+        await asyncio.to_thread(self.pulses_loop_mode_A)
+        int_pulses = int(pulses)
+        float_time = float(time_bp)
+        _print_loop_pulse_banner('A', pulses, time_bp)
+        await self._pulse_train_async(int_pulses, float_time)
+        print('Pulses have finished') # End of the pulses message
+
+    async def send_pulses_loop_B_async(self, pulses, time_bp):
+        """Coroutine version of send_pulses_loop_B
+        Other tasks of the event loop (MFC reads, logging...) keep running in between the pulses
+
+        Args:
+            pulses (int): Number of pulses
+            time_bp (float): Time in seconds between pulses
+        """
+        import asyncio
+
+        await asyncio.to_thread(self.pulses_loop_mode_B)
+        int_pulses = int(pulses)
+        float_time = float(time_bp)
+        _print_loop_pulse_banner('B', pulses, time_bp)
+        await self._pulse_train_async(int_pulses, float_time)
+        print('Pulses have finished') # End of the pulses message
+
+    async def _pulse_train_async(self, int_pulses, float_time):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        # The writes are queued to the serial worker, the coroutine only awaits them
+        write = functools.partial(self._submit_serial, self.ser.write, b'/ATO\r')
+        # Setting _stop_pulses stops this train too, same as the trains run by _send_pulse_train
+        stop_is_set = self._stop_pulses.is_set
+        self._stop_pulses.clear()
+        # Every pulse toggles valve A, its cached position is no longer valid
+        self.status['A'] = None
+        t0 = loop.time()
+        for pulse, start, report in _pulse_schedule(int_pulses, float_time):
+            if stop_is_set():
+                break
+            await asyncio.wrap_future(write())
+            if report:
+                _print_pulse_status(pulse, int_pulses)
+            await asyncio.sleep(max(0.0, t0 + start + float_time - loop.time()))
+
+    def _send_pulse_train(self, pulse_train, *args):
+        """Runs a pulse train in the serial worker, which keeps the inter-pulse schedule
+        Interrupting the wait (Ctrl-C) also stops the pulse train in the worker
+
+        Args:
+            pulse_train (callable): Pulse train job, _pulse_train or _valve_pulse_train
+            *args: Arguments of the pulse train
+        """
+        self._stop_pulses.clear()
+        try:
+            _wait_result(self._submit_serial(pulse_train, *args))
+        except KeyboardInterrupt:
+            self._stop_pulses.set()
+            raise
+
+    def _pulse_train(self, int_pulses, float_time):
+        # Attribute and global lookups are bound to locals once, outside of the pulse loop
+        write = self.ser.write
+        sleep = time.sleep
+        monotonic = time.monotonic
+        stop_is_set = self._stop_pulses.is_set
+        pulse_cmd = b'/ATO\r' # Comand that executes the pulses valve actuation
+        # Every pulse toggles valve A, its cached position is no longer valid
+        self.status['A'] = None
+        t0 = monotonic()
+        for pulse, start, report in _pulse_schedule(int_pulses, float_time):
+            if stop_is_set():
+                break
             # tmp.pulse_ON()
-            self.ser.write(b'/ATO\r') # Comand that executes the pulses valve actuation
-            print('Sending pulse number {} of {}'.format(pulse+1,int_pulses), end = "\r") # Pulse status message for terminal window
-            time.sleep(float_time) # Conversion of seconds to miliseconds
+            write(pulse_cmd)
+            if report:
+                _print_pulse_status(pulse, int_pulses) # Pulse status message for terminal window
+            sleep(max(0.0, t0 + start + float_time - monotonic()))
             # tmp.pulse_OFF()
-        print('Pulses have finished') # End of the pulses message
 
     def send_pulses_valve_A(self,pulses,time_vo,time_bp):
         #total_time_loop = (float(pulses) * float(time_bp)) + (float(pulses) * float(time_vo))
@@ -603,19 +1169,40 @@ class GasControl:
         print('Number of pulses (valve): {}\nTime valve open (s): {}\nTime in between pulses (s): {}'.format(pulses,time_vo,time_bp))
         print('Valve Position Off: mixing line -> reactor /// pulses line carrier -> loop 2 -> loop 1 -> waste')
         print('Valve Position On: pulses line carrier -> reactor /// mixing line -> loop 2 -> loop 1 -> waste')
-        for pulse in range(0, int_pulses):
-            self.cont_mode_B() # Comand that executes the pulses valve actuation
-            time.sleep(float_time_vo + valve_actuation_time) # Conversion of seconds to miliseconds
-            self.cont_mode_A() # Comand that executes the pulses valve actuation
-            print('Sending pulse number {} of {}'.format(pulse+1,int_pulses), end = "\r") # Pulse status message for terminal window
-            time.sleep(float_time_bp) # Conversion of seconds to miliseconds
+        period = float_time_vo + valve_actuation_time + float_time_bp
+        self._send_pulse_train(self._valve_pulse_train, int_pulses, float_time_vo + valve_actuation_time, period)
+        # The pulse train does not verify the valves, a full cont_mode_A re-syncs them and self.status
+        self.cont_mode_A(verbose=False)
         print('Pulses have finished') # End of the pulses message
 
+    def _valve_pulse_train(self, int_pulses, time_open, period):
+        write = self.ser.write
+        sleep = time.sleep
+        monotonic = time.monotonic
+        stop_is_set = self._stop_pulses.is_set
+        # cont_mode_B and cont_mode_A command sequences, written without position checks
+        seq_B = _CW_CMD['A'] + _CC_CMD['B'] + _CW_CMD['C']
+        seq_A = _CW_CMD['A'] + _CW_CMD['B'] + _CW_CMD['C']
+        for valve in 'ABC':
+            self.status[valve] = None
+        t0 = monotonic()
+        for pulse, start, report in _pulse_schedule(int_pulses, period):
+            if stop_is_set():
+                break
+            t_pulse = t0 + start
+            write(seq_B) # Comand that executes the pulses valve actuation
+            sleep(max(0.0, t_pulse + time_open - monotonic()))
+            write(seq_A) # Comand that executes the pulses valve actuation
+            if report:
+                _print_pulse_status(pulse, int_pulses) # Pulse status message for terminal window
+            sleep(max(0.0, t_pulse + period - monotonic()))
+
     def define_flowsms(self):
         """Function to define the parameters of the Flow-SMS mass flow controllers
-        The parameters are defined in the following dictionaries:
+        The parameters come from the module level _GAS_TABLE and are exposed in the following dictionaries:
 
         gas_list: List of the available gases
+        gas_set: Frozenset of the available gases, used for membership tests
         gas_dict: Dictionary that assigns a number to each gas
         gas_ID: Dictionary that assigns a node ID to each gas
         gas_cal: Dictionary that assigns a calibration ID to each gas. If there it is applicable to one gas, the value is None.
@@ -623,153 +1210,18 @@ class GasControl:
         calibration_factor: Dictionary that assigns a calibration factor to each gas
         feed_gas_functions: Dictionary that assigns a function to each gas
         gas_float_to_int_factor: Dictionary that assigns a conversion factor from float to int to each gas
+        gas_scale_const: Dictionary that assigns the setpoint counts per sccm (32000 / gas_float_to_int_factor) to each gas
+        gas_info: Dictionary that assigns a GasEntry with all the parameters above to each gas
         """
-        self.gas_list = [
-            "H2_A",
-            "H2_B",
-            "D2_A",
-            "D2_B",
-            "O2_A",
-            "O2_B",
-            "CO_AH",
-            "CO_AL",
-            "CO_BH",
-            "CO_BL",
-            "CO2_AH",
-            "CO2_AL",
-            "CO2_BH",
-            "CO2_BL",
-            "CH4_A",
-            "CH4_B",
-            "C2H6_A",
-            "C2H6_B",
-            "C3H8_A",
-            "C3H8_B",
-            "He_A",
-            "He_B",
-            "Ar_A",
-            "Ar_B",
-            "N2_A",
-            "N2_B",
-        ]
-
-        self.gas_dict = {self.gas_list[i]: i for i in range(len(self.gas_list))}
-
-        self.gas_ID = {
-            "H2_A": 4,
-            "D2_A":4,
-            "O2_A": 5,
-            "CO_AH": 6,
-            "CO_AL": 6,
-            "CO2_AH": 6,
-            "CO2_AL": 6,
-            "CH4_A": 7,
-            "C2H6_A": 7,
-            "C3H8_A": 7,
-            "He_A": 8,
-            "Ar_A": 8,
-            "N2_A": 8,
-            "He_B": 9,
-            "Ar_B": 9,
-            "N2_B": 9,
-            "CH4_B": 10,
-            "C2H6_B": 10,
-            "C3H8_B": 10,
-            "CO_BH": 11,
-            "CO_BL": 11,
-            "CO2_BH": 11,
-            "CO2_BL": 11,
-            "O2_B": 12,
-            "H2_B": 13,
-            "D2_B":13,
-        }
-
-        self.gas_cal = {
-            "H2_A": 0,
-            "H2_B": 0,
-            "D2_A": 1,
-            "D2_B": 1,
-            "O2_A": 0,
-            "O2_B": 0,
-            "CO_AH": 0,
-            "CO_BH": 0,
-            "CO2_AH": 1,
-            "CO2_BH": 1,
-            "CO2_AL": 2,
-            "CO2_BL": 2,
-            "CO_AL": 3,
-            "CO_BL": 3,
-            "CH4_A": 0,
-            "CH4_B": 0,
-            "C2H6_A": 1,
-            "C2H6_B": 1,
-            "C3H8_A": 2,
-            "C3H8_B": 2,
-            "He_A": 0,
-            "He_B": 0,
-            "Ar_A": 1,
-            "Ar_B": 1,
-            "N2_A": 2,
-            "N2_B": 2,
-        }
-
-        self.gas_flow_range = {
-            "CO2_AH": [0.6, 30.0],
-            "CO2_AL": [0.26, 13.0],
-            "CO2_BH": [0.6, 30.0],
-            "CO2_BL": [0.26, 13.0],
-            "CO_AH": [0.6, 30.0],
-            "CO_AL": [0.36, 18.0],
-            "CO_BH": [0.6, 30.0],
-            "CO_BL": [0.36, 18.0],
-            "CH4_A": [0.6, 30.0],
-            "CH4_B": [0.6, 30.0],
-            "C2H6_A": [0.6, 30.0],
-            "C2H6_B": [0.6, 30.0],
-            "C3H8_A": [0.6, 30.0],
-            "C3H8_B": [0.6, 30.0],
-            "H2_A": [0.6, 30.0],
-            "H2_B": [0.6, 30.0],
-            "D2_A": [0.6, 30.0],
-            "D2_B": [0.6, 30.0],
-            "O2_A": [0.6, 30.0],
-            "O2_B": [0.6, 30.0],
-            "He_A": [1.2, 60.0],
-            "He_B": [1.2, 60.0],
-            "Ar_A": [1.2, 60.0],
-            "Ar_B": [1.2, 60.0],
-            "N2_A": [1.2, 60.0],
-            "N2_B": [1.2, 60.0],
-        }
-
-        self.calibration_factor = {
-            "H2_A": 1.0,
-            "H2_B": 1.0,
-            "D2_A": 1.0,
-            "D2_B": 1.0,
-            "O2_A": 1.0,
-            "O2_B": 1.0,
-            "CO_AH": 1.0,
-            "CO_AL": 1.0,
-            "CO_BH": 1.0,
-            "CO_BL": 1.0,
-            "CH4_A": 1.0,
-            "CH4_B": 1.0,
-            "C2H6_A": 1.0,
-            "C2H6_B": 1.0,
-            "C3H8_A": 1.0,
-            "C3H8_B": 1.0,
-            "CO2_AH": 1.0,
-            "CO2_AL": 1.0,
-            "CO2_BH": 1.0,
-            "CO2_BL": 1.0,
-            "He_A": 1.0,
-            "He_B": 1.0,
-            "Ar_A": 1.0,
-            "Ar_B": 1.0,
-            "N2_A": 1.0,
-            "N2_B": 1.0,
-        }
+        self.gas_list = list(_GAS_IDX)
+        self.gas_set = frozenset(_GAS_IDX)
+        self.gas_dict = _GAS_IDX
+        self.gas_ID = _GAS_ID
+        self.gas_cal = _GAS_CAL
+        self.gas_flow_range = _GAS_FLOW_RANGE
+        self.calibration_factor = _GAS_CALIBRATION_FACTOR
+        self.gas_float_to_int_factor = _GAS_FLOAT_TO_INT_FACTOR
+        self.gas_scale_const = _GAS_SCALE_CONST
 
         self.feed_gas_functions = {
             "H2_A": self.feed_H2_A,
@@ -800,33 +1252,9 @@ class GasControl:
             "N2_B": self.carrier_Ar_B,
         }
 
-        self.gas_float_to_int_factor = {
-            "H2_A": 30,
-            "H2_B": 30,
-            "D2_A": 30,
-            "D2_B": 30,
-            "O2_A": 30,
-            "O2_B": 30,
-            "CO_AH": 30,
-            "CO_AL": 18,
-            "CO_BH": 30,
-            "CO_BL": 18,
-            "CH4_A": 30,
-            "CH4_B": 30,
-            "C2H6_A": 30,
-            "C2H6_B": 30,
-            "C3H8_A": 30,
-            "C3H8_B": 30,
-            "CO2_AH": 30,
-            "CO2_AL": 13,
-            "CO2_BH": 30,
-            "CO2_BL": 13,
-            "He_A": 60,
-            "He_B": 60,
-            "Ar_A": 60,
-            "Ar_B": 60,
-            "N2_A": 60,
-            "N2_B": 60,
+        self.gas_info = {
+            gas: GasEntry(lo, hi, cal_factor, float_to_int, node, cal, self.feed_gas_functions[gas])
+            for gas, node, cal, (lo, hi), cal_factor, float_to_int in _GAS_TABLE
         }
 
     def set_flowrate(
@@ -840,67 +1268,89 @@ class GasControl:
             gas (str): Gas for which the flow rate will be set
             flow (float): Flow rate in sccm
         """
-        if gas not in self.gas_list:
-            raise ValueError("Gas not in list of available gases")
+        params = self._build_flowrate_params(gas, flow)
+        # The acknowledgement is not checked here, the setpoint of the node is unknown from now on
+        self._setpoint_cache.pop(params[-1]["node"], None)
+        self.mfc_master.write_parameters(params)
 
-        while True:
-            if (flow is None) or (flow == 0.0):
-                flow_conv = 0.0
-                break
+    def _build_flowrate_params(self, gas, flow):
+        """Builds the propar parameters that set the flow rate of a gas without writing them
+        The flow range is checked and the gas is fed to its line here, as in set_flowrate
 
-            flow_conv = flow / self.calibration_factor[gas]
+        Args:
+            gas (str): Gas for which the flow rate will be set
+            flow (float): Flow rate in sccm
 
-            if flow_conv < self.gas_flow_range[gas][0]:
-                print(
-                    f"{gas} flow lower than minimum {self.gas_flow_range[gas][0]} sccm"
-                )
-                interval = input(
-                    'Write "Yes" for setting a new flow or "No" for quiting the program: '
-                )
-                if interval == "Yes":
-                    flow = float(input("Enter new flow: "))
-                elif interval == "No":
-                    raise SystemExit
-                else:
+        Returns:
+            list[dict]: propar parameters for the node of the gas
+        """
+        propar = self._propar
+
+        if gas not in self.gas_set:
+            raise ValueError("Gas not in list of available gases")
+
+        lo, hi, cf, float_to_int, node, cal, feed_gas = self.gas_info[gas]
+
+        # Zero flow only closes the controller, no range check nor gas feeding
+        if (flow is None) or (flow == 0.0):
+            flow_data = 0
+        else:
+            while True:
+                # A new flow of 0 can still be entered at the prompt below
+                if flow == 0.0:
+                    flow_conv = 0.0
                     break
 
-            elif flow_conv > self.gas_flow_range[gas][1]:
-                print(
-                    f"{gas} flow higher than maximum {self.gas_flow_range[gas][1]} sccm"
-                )
-                interval = input(
-                    'Write "Yes" for setting a new flow or "No" for quiting the program: '
-                )
-                if interval == "Yes":
-                    flow = float(input("Enter new flow: "))
-                elif interval == "No":
-                    raise SystemExit
+                flow_conv = flow / cf
+
+                if flow_conv < lo:
+                    print(f"{gas} flow lower than minimum {lo} sccm")
+                    interval = input(
+                        'Write "Yes" for setting a new flow or "No" for quiting the program: '
+                    )
+                    if interval == "Yes":
+                        flow = float(input("Enter new flow: "))
+                    elif interval == "No":
+                        raise SystemExit
+                    else:
+                        break
+
+                elif flow_conv > hi:
+                    print(f"{gas} flow higher than maximum {hi} sccm")
+                    interval = input(
+                        'Write "Yes" for setting a new flow or "No" for quiting the program: '
+                    )
+                    if interval == "Yes":
+                        flow = float(input("Enter new flow: "))
+                    elif interval == "No":
+                        raise SystemExit
+                    else:
+                        break
                 else:
                     break
-            else:
-                break
 
-        if flow_conv > 0.0:
-            self.feed_gas_functions[gas]()
+            if flow_conv > 0.0:
+                feed_gas()
 
-        flow_data = int(flow_conv * 32000 / self.gas_float_to_int_factor[gas])
+            # Not multiplied by the pre-divided gas_scale_const, its rounding error truncates some setpoints one count low
+            flow_data = int(flow_conv * 32000 / float_to_int)
 
         param = []
 
-        if self.gas_cal[gas] is not None:
+        if cal is not None:
             param.append(
                 {
-                    "node": self.gas_ID[gas],
+                    "node": node,
                     "proc_nr": 1,
                     "parm_nr": 16,
                     "parm_type": propar.PP_TYPE_INT8,
-                    "data": self.gas_cal[gas],
+                    "data": cal,
                 }
             )
 
         param.append(
             {
-                "node": self.gas_ID[gas],
+                "node": node,
                 "proc_nr": 1,
                 "parm_nr": 1,
                 "parm_type": propar.PP_TYPE_INT16,
@@ -908,7 +1358,7 @@ class GasControl:
             }
         )
 
-        status = self.mfc_master.write_parameters(param)
+        return param
 
     def flowsms_setpoints(
         self,
@@ -946,8 +1396,8 @@ class GasControl:
             H2_B (float): Flow rate of H2 in sccm for gas line B [default: None]
             D2_A (float): Flow rate of D2 in sccm for gas line A [default: None]
             D2_B (float): Flow rate of D2 in sccm for gas line B [default: None]
-            O2_A (float): Flow rate of O2 in sccm for gas line A [default: None]
-            O2_B (float): Flow rate of O2 in sccm for gas line B [default: None]
+            O2_A (float): Flow rate of O2 in sccm for gas line A, None closes the O2 controller [default: None]
+            O2_B (float): Flow rate of O2 in sccm for gas line B, None closes the O2 controller [default: None]
             CO_AH (float): Flow rate of CO in sccm for gas line A with high flow calibration curve [default: None]
             CO_AL (float): Flow rate of CO in sccm for gas line A with low flow calibration curve [default: None]
             CO_BH (float): Flow rate of CO in sccm for gas line B with high flow calibration curve [default: None]
@@ -967,65 +1417,132 @@ class GasControl:
             N2_A (float): Flow rate of N2 in sccm for gas line A [default: None]
             N2_B (float): Flow rate of N2 in sccm for gas line B [default: None]
         """
-        if CO_AH is not None and CO_AH > 0.0:
-            self.set_flowrate("CO_AH", CO_AH)
-        elif CO_AL is not None and CO_AL > 0.0:
-            self.set_flowrate("CO_AL", CO_AL)
-        elif CO2_AH is not None and CO2_AH > 0.0:
-            self.set_flowrate("CO2_AH", CO2_AH)
-        else:
-            self.set_flowrate("CO2_AL", CO2_AL)
-
-        if CO_BH is not None and CO_BH > 0.0:
-            self.set_flowrate("CO_BH", CO_BH)
-        elif CO_BL is not None and CO_BL > 0.0:
-            self.set_flowrate("CO_BL", CO_BL)
-        elif CO2_BH is not None and CO2_BH > 0.0:
-            self.set_flowrate("CO2_BH", CO2_BH)
-        else:
-            self.set_flowrate("CO2_BL", CO2_BL)
-        
-        if CH4_A is not None and CH4_A > 0.0:
-            self.set_flowrate("CH4_A", CH4_A)
-        elif C2H6_A is not None and C2H6_A > 0.0:
-            self.set_flowrate("C2H6_A", C2H6_A)
-        else:
-            self.set_flowrate("C3H8_A", C3H8_A)
+        flows = locals()
+        params = []
+        for group in _SETPOINT_GROUPS:
+            for gas in group:
+                flow = flows[gas]
+                if flow is not None and flow > 0.0:
+                    break
+            params += self._build_flowrate_params(gas, flow)
 
-        if CH4_B is not None and CH4_B > 0.0:
-            self.set_flowrate("CH4_B", CH4_B)
-        elif C2H6_B is not None and C2H6_B > 0.0:
-            self.set_flowrate("C2H6_B", C2H6_B)
-        else:
-            self.set_flowrate("C3H8_B", C3H8_B)
+        for gas in _OPTIONAL_SETPOINTS:
+            flow = flows[gas]
+            # Closing a controller that is known to be closed already is skipped
+            if not flow and self._setpoint_cache.get(self.gas_ID[gas]) == 0:
+                continue
+            params += self._build_flowrate_params(gas, flow)
 
-        if H2_A is not None and H2_A > 0.0:
-            self.set_flowrate("H2_A", H2_A)
-        else:
-            self.set_flowrate("D2_A", D2_A)
-        
-        if H2_B is not None and H2_B > 0.0:
-            self.set_flowrate("H2_B", H2_B)
-        else:
-            self.set_flowrate("D2_B", D2_B)
-        
-        if He_A is not None and He_A > 0.0:
-            self.set_flowrate("He_A", He_A)
-        elif Ar_A is not None and Ar_A > 0.0:
-            self.set_flowrate("Ar_A", Ar_A)
-        else:
-            self.set_flowrate("N2_A", N2_A)
+        self._write_mfc_parameters(params)
 
-        if He_B is not None and He_B > 0.0:
-            self.set_flowrate("He_B", He_B)
-        elif Ar_B is not None and Ar_B > 0.0:
-            self.set_flowrate("Ar_B", Ar_B)
-        else:
-            self.set_flowrate("N2_B", N2_B)
+    def flowsms_status_pair(self):
+        """Reads the pressures of gas lines A and B from the Flow-SMS pressure controllers in a single batch
+
+        Returns:
+            tuple[float, float]: Pressures of gas lines A and B in psia
+        """
+        propar = self._propar
+
+        params = [
+            {"node": node, "proc_nr": 33, "parm_nr": 0, "parm_type": propar.PP_TYPE_FLOAT}
+            for node in _PRESSURE_NODES
+        ]
+        values = self._read_mfc_parameters(params)
+        missing = [param["node"] for param, value in zip(params, values) if value.get("data") is None]
+        if missing:
+            raise IOError("No answer from the Flow-SMS nodes {}".format(missing))
+        return values[0]["data"], values[1]["data"]
+
+    def _write_mfc_parameters(self, params, timeout=1.0):
+        """Writes a batch of Flow-SMS parameters that can belong to several nodes
+        As for the reads, the parameters are grouped by node and the writes of all the nodes are sent at once
+        (non-blocking callbacks) before waiting for the acknowledgements. The order of the parameters of a node is kept
+        The flow setpoints are stored in self._setpoint_cache once their node acknowledges the write
+        An IOError listing the nodes that rejected the write or did not answer in time is raised after all the nodes are waited for
+
+        Args:
+            params (list[dict]): propar parameters to write
+            timeout (float): Maximum time in seconds to wait for the acknowledgements [default: 1.0]
+        """
+        propar = self._propar
+
+        nodes = {}
+        for param in params:
+            nodes.setdefault(param["node"], []).append(param)
+
+        # Status returned by each node that rejected its write
+        failed = {}
+        acknowledged = []
+        for node, node_params in nodes.items():
+            setpoints = [param["data"] for param in node_params if (param["proc_nr"], param["parm_nr"]) == (1, 1)]
+            if setpoints:
+                # Unknown until the write is acknowledged
+                self._setpoint_cache.pop(node, None)
+            event = threading.Event()
+
+            def on_ack(result, node=node, setpoints=setpoints, event=event):
+                # Runs in the propar message thread, the event has to be set whatever the result
+                try:
+                    if result == propar.PP_STATUS_OK:
+                        if setpoints:
+                            self._setpoint_cache[node] = setpoints[-1]
+                    else:
+                        failed[node] = result
+                finally:
+                    event.set()
+
+            self.mfc_master.write_parameters(node_params, callback=on_ack)
+            acknowledged.append((node, event))
+
+        deadline = time.monotonic() + timeout
+        unanswered = [
+            node for node, event in acknowledged if not event.wait(max(0.0, deadline - time.monotonic()))
+        ]
+        if failed or unanswered:
+            raise IOError(
+                "Flow-SMS write failed, status by node: {}, no answer from the nodes: {}".format(dict(failed), unanswered)
+            )
 
-        self.set_flowrate("O2_A", O2_A)
+    def _read_mfc_parameters(self, params, timeout=1.0):
+        """Reads a batch of Flow-SMS parameters that can belong to several nodes
+        A propar message addresses a single node, so the parameters are grouped by node and the
+        requests of all the nodes are sent at once (non-blocking callbacks) before waiting for the answers
 
-        self.set_flowrate("O2_B", O2_B)
+        Args:
+            params (list[dict]): propar parameters to read
+            timeout (float): Maximum time in seconds to wait for the answers [default: 1.0]
+
+        Returns:
+            list[dict]: Read parameters in the same order as params, empty dicts for unanswered parameters.
+                The data of a parameter answered with an error status is None
+        """
+        nodes = {}
+        for index, param in enumerate(params):
+            nodes.setdefault(param["node"], []).append(index)
+
+        values = [{} for _ in params]
+        answered = []
+        for indexes in nodes.values():
+            event = threading.Event()
+
+            def callback(result, indexes=indexes, event=event):
+                # Runs in the propar message thread, an exception here would stop all the Flow-SMS communication
+                try:
+                    # A request that fails (e.g. timeout) is answered with a bare status code instead of the parameters
+                    if isinstance(result, list):
+                        for index, value in zip(indexes, result):
+                            if isinstance(value, dict):
+                                values[index] = value
+                finally:
+                    event.set()
+
+            self.mfc_master.read_parameters([params[index] for index in indexes], callback=callback)
+            answered.append(event)
+
+        deadline = time.monotonic() + timeout
+        for event in answered:
+            event.wait(max(0.0, deadline - time.monotonic()))
+        return values
 
     def flowsms_status(self, delay=0.0):
         """Function that reads the flow rates of the gases in the Flow-SMS mass flow controllers
@@ -1033,10 +1550,11 @@ class GasControl:
         Args:
             delay (float): Delay time in seconds before reading the flow rates [default: 0.0]
         """
+        propar = self._propar
 
         # Node ID values assigned in the MFCs configuration
 
-        ID_P_A = 3
+        ID_P_A, ID_P_B = _PRESSURE_NODES
         ID_H2_D2_A = 4
         ID_O2_A = 5
         ID_CO_CO2_A = 6
@@ -1047,7 +1565,6 @@ class GasControl:
         ID_CO_CO2_B = 11
         ID_O2_B = 12
         ID_H2_D2_B = 13
-        ID_P_B = 14
 
         # ID assigned in the MFCs configuration for calibration curve allocation
         H2_A = 0
@@ -1260,7 +1777,7 @@ class GasControl:
                 "parm_type": propar.PP_TYPE_FLOAT,
             },
             {
-                "node": ID_CARRIER_A,
+                "node": ID_CARRIER_B,
                 "proc_nr": 33,
                 "parm_nr": 3,
                 "parm_type": propar.PP_TYPE_FLOAT,
@@ -1289,419 +1806,278 @@ class GasControl:
             }
         ]
 
-        # Sending the specified parameters to the Flow-SMS
-        values_h2_d2_a = self.mfc_master.read_parameters(params_h2_d2_a)
-        values_h2_d2_b = self.mfc_master.read_parameters(params_h2_d2_b)
-        values_o2_a = self.mfc_master.read_parameters(params_o2_a)
-        values_o2_b = self.mfc_master.read_parameters(params_o2_b)
-        values_co_co2_a = self.mfc_master.read_parameters(params_co_co2_a)
-        values_co_co2_b = self.mfc_master.read_parameters(params_co_co2_b)
-        values_hc_a = self.mfc_master.read_parameters(params_hc_a)
-        values_hc_b = self.mfc_master.read_parameters(params_hc_b)
-        values_carrier_a = self.mfc_master.read_parameters(params_carrier_a)
-        values_carrier_b = self.mfc_master.read_parameters(params_carrier_b)
-        values_p_a = self.mfc_master.read_parameters(params_p_a)
-        values_p_b = self.mfc_master.read_parameters(params_p_b)
+        # Sending the specified parameters to the Flow-SMS in a single batch
+        all_params = (
+            params_h2_d2_a
+            + params_h2_d2_b
+            + params_o2_a
+            + params_o2_b
+            + params_co_co2_a
+            + params_co_co2_b
+            + params_hc_a
+            + params_hc_b
+            + params_carrier_a
+            + params_carrier_b
+            + params_p_a
+            + params_p_b
+        )
+        values = self._read_mfc_parameters(all_params)
+        values_h2_d2_a = values[0:3]
+        values_h2_d2_b = values[3:6]
+        values_o2_a = values[6:8]
+        values_o2_b = values[8:10]
+        values_co_co2_a = values[10:13]
+        values_co_co2_b = values[13:16]
+        values_hc_a = values[16:19]
+        values_hc_b = values[19:22]
+        values_carrier_a = values[22:25]
+        values_carrier_b = values[25:28]
+
+        missing = sorted({param["node"] for param, value in zip(all_params, values) if value.get("data") is None})
+        if missing:
+            raise IOError("No answer from the Flow-SMS nodes {}".format(missing))
 
         # Creating induviduals lists for the read values from each MFC
-        lst_h2_d2_a = []
-        for value in values_h2_d2_a:
-            if "data" in value:
-                flow = value.get("data")
-            lst_h2_d2_a.append(format(flow, ".2f"))
-        fluid_h2_d2_a = float(lst_h2_d2_a[2])
-        if fluid_h2_d2_a == 0:
-            fluid_h2_d2_a = "H2_A"
-        elif fluid_h2_d2_a == 1:
-            fluid_h2_d2_a = "D2_A"
-
-        lst_h2_d2_b = []
-        for value in values_h2_d2_b:
-            if "data" in value:
-                flow = value.get("data")
-            lst_h2_d2_b.append(format(flow, ".2f"))
-        fluid_h2_d2_b = float(lst_h2_d2_b[2])
-        if fluid_h2_d2_b == 0:
-            fluid_h2_d2_b = "H2_B"
-        elif fluid_h2_d2_b == 1:
-            fluid_h2_d2_b = "D2_B"
-
-        lst_o2_a = []
-        for value in values_o2_a:
-            if "data" in value:
-                flow = value.get("data")
-            lst_o2_a.append(format(flow, ".2f"))
-
-        lst_o2_b = []
-        for value in values_o2_b:
-            if "data" in value:
-                flow = value.get("data")
-            lst_o2_b.append(format(flow, ".2f"))   
-        
-        lst_co_co2_a = []
-        for value in values_co_co2_a:
-            if "data" in value:
-                flow = value.get("data")
-            lst_co_co2_a.append(format(flow, ".2f"))
-        fluid_co_co2_a = float(lst_co_co2_a[2])
-        if fluid_co_co2_a == 0:
-            fluid_co_co2_a = "CO_AH"
-        elif fluid_co_co2_a == 1:
-            fluid_co_co2_a = "CO2_AH"
-        elif fluid_co_co2_a == 2:
-            fluid_co_co2_a = "CO2_AL"
-        elif fluid_co_co2_a == 3:
-            fluid_co_co2_a = "CO_AL"
-
-        lst_co_co2_b = []
-        for value in values_co_co2_b:
-            if "data" in value:
-                flow = value.get("data")
-            lst_co_co2_b.append(format(flow, ".2f"))
-        fluid_co_co2_b = float(lst_co_co2_b[2])
-        if fluid_co_co2_b == 0:
-            fluid_co_co2_b = "CO_BH"
-        elif fluid_co_co2_b == 1:
-            fluid_co_co2_b = "CO2_BH"
-        elif fluid_co_co2_b == 2:
-            fluid_co_co2_b = "CO2_BL"
-        elif fluid_co_co2_b == 3:
-            fluid_co_co2_b = "CO_BL"
-
-        lst_hc_a = []
-        for value in values_hc_a:
-            if "data" in value:
-                flow = value.get("data")
-            lst_hc_a.append(format(flow, ".2f"))
-        fluid_hc_a = float(lst_hc_a[2])
-        if fluid_hc_a == 0:
-            fluid_hc_a = "CH4_A"
-        elif fluid_hc_a == 1:
-            fluid_hc_a = "C2H6_A"
-        elif fluid_hc_a == 2:
-            fluid_hc_a = "C3H8_A"
-
-        lst_hc_b = []
-        for value in values_hc_b:
-            if "data" in value:
-                flow = value.get("data")
-            lst_hc_b.append(format(flow, ".2f"))
-        fluid_hc_b = float(lst_hc_b[2])
-        if fluid_hc_b == 0:
-            fluid_hc_b = "CH4_B"
-        elif fluid_hc_b == 1:
-            fluid_hc_b = "C2H6_B"
-        elif fluid_hc_b == 2:
-            fluid_hc_b = "C3H8_B"
-
-        lst_carrier_a = []
-        for value in values_carrier_a:
-            if "data" in value:
-                flow = value.get("data")
-            lst_carrier_a.append(format(flow, ".2f"))
-        fluid_carrier_a = float(lst_carrier_a[2])
-        if fluid_carrier_a == 0:
-            fluid_carrier_a = "He"
-        elif fluid_carrier_a == 1:
-            fluid_carrier_a = "Ar"
-        elif fluid_carrier_a == 2:
-            fluid_carrier_a = "N2"
-
-        lst_carrier_b = []
-        for value in values_carrier_b:
-            if "data" in value:
-                flow = value.get("data")
-            lst_carrier_b.append(format(flow, ".2f"))
-        fluid_carrier_b = float(lst_carrier_b[2])
-        if fluid_carrier_b == 0:
-            fluid_carrier_b = "He"
-        elif fluid_carrier_b == 1:
-            fluid_carrier_b = "Ar"
-        elif fluid_carrier_b == 2:
-            fluid_carrier_b = "N2"
-
-        lst_p_a = []
-        for value in values_p_a:
-            if "data" in value:
-                pressure = value.get("data")
-            lst_p_a.append(format(pressure, ".2f"))
-            # return lst_p_a[0]
-
-        lst_p_b = []
-        for value in values_p_b:
-            if "data" in value:
-                pressure = value.get("data")
-            lst_p_b.append(format(pressure, ".2f"))
-            # return lst_p_b[0]
+        lst_h2_d2_a = [value["data"] for value in values_h2_d2_a]
+        fluid_h2_d2_a = _fluid_name(_H2_D2_A_NAMES, lst_h2_d2_a[2])
+
+        lst_h2_d2_b = [value["data"] for value in values_h2_d2_b]
+        fluid_h2_d2_b = _fluid_name(_H2_D2_B_NAMES, lst_h2_d2_b[2])
+
+        lst_o2_a = [value["data"] for value in values_o2_a]
+
+        lst_o2_b = [value["data"] for value in values_o2_b]
+
+        lst_co_co2_a = [value["data"] for value in values_co_co2_a]
+        fluid_co_co2_a = _fluid_name(_CO_CO2_A_NAMES, lst_co_co2_a[2])
+
+        lst_co_co2_b = [value["data"] for value in values_co_co2_b]
+        fluid_co_co2_b = _fluid_name(_CO_CO2_B_NAMES, lst_co_co2_b[2])
+
+        lst_hc_a = [value["data"] for value in values_hc_a]
+        fluid_hc_a = _fluid_name(_HC_A_NAMES, lst_hc_a[2])
+
+        lst_hc_b = [value["data"] for value in values_hc_b]
+        fluid_hc_b = _fluid_name(_HC_B_NAMES, lst_hc_b[2])
+
+        lst_carrier_a = [value["data"] for value in values_carrier_a]
+        fluid_carrier_a = _fluid_name(_CARRIER_NAMES, lst_carrier_a[2])
+
+        lst_carrier_b = [value["data"] for value in values_carrier_b]
+        fluid_carrier_b = _fluid_name(_CARRIER_NAMES, lst_carrier_b[2])
+
+        # A single pressure is read from each pressure controller
+        pressure_a = values[28]["data"]
+        pressure_b = values[29]["data"]
 
         # Calculating percentage values for the actual flows
 
-        total_flow_a = float(
-            format(
-                float(lst_h2_d2_a[0])
-                + float(lst_o2_a[0])
-                + float(lst_co_co2_a[0])
-                + float(lst_hc_a[0])
-                + float(lst_carrier_a[0]),
-                ".2f",
-            )
+        total_flow_a, (H2_D2_percent_a, O2_percent_a, CO_CO2_percent_a, HC_percent_a, carrier_a_percent) = _percentages(
+            (lst_h2_d2_a[0], lst_o2_a[0], lst_co_co2_a[0], lst_hc_a[0], lst_carrier_a[0])
         )
-        if total_flow_a != 0:
-            H2_D2_percent_a = format((float(lst_h2_d2_a[0]) / total_flow_a) * 100, ".1f")
-            O2_percent_a = format((float(lst_o2_a[0]) / total_flow_a) * 100, ".1f")
-            CO_CO2_percent_a = format((float(lst_co_co2_a[0]) / total_flow_a) * 100, ".1f")
-            HC_percent_a = format((float(lst_hc_a[0]) / total_flow_a) * 100, ".1f")
-            # carrier_a_percent = format((float(lst_carrier_a[0])/total_flow_a)*100, '.1f')
-
-        total_flow_b = float(
-            format(
-                float(lst_h2_d2_b[0])
-                + float(lst_o2_b[0])
-                + float(lst_co_co2_b[0])
-                + float(lst_hc_b[0])
-                + float(lst_carrier_b[0]),
-                ".2f",
-            )
+        total_flow_b, (H2_D2_percent_b, O2_percent_b, CO_CO2_percent_b, HC_percent_b, carrier_b_percent) = _percentages(
+            (lst_h2_d2_b[0], lst_o2_b[0], lst_co_co2_b[0], lst_hc_b[0], lst_carrier_b[0])
         )
-        if total_flow_b != 0:
-            H2_D2_percent_b = format((float(lst_h2_d2_b[0]) / total_flow_b) * 100, ".1f")
-            O2_percent_b = format((float(lst_o2_b[0]) / total_flow_b) * 100, ".1f")
-            CO_CO2_percent_b = format((float(lst_co_co2_b[0]) / total_flow_b) * 100, ".1f")
-            HC_percent_b = format((float(lst_hc_b[0]) / total_flow_b) * 100, ".1f")
-            # carrier_b_percent = format((float(lst_carrier_b[0])/total_flow_b)*100, '.1f')
 
         # Creating and printing table with the actual and set flows, and line pressures
-        print(" ")
-        print("------------------------------------------------------------")
-        print("-------------------")
-        print("--- Flow Report ---")
-        print("-------------------")
+        # Setpoints that round to 0.00 sccm are not reported. The report is printed at once
+        report = [
+            " ",
+            "------------------------------------------------------------",
+            "-------------------",
+            "--- Flow Report ---",
+            "-------------------",
+        ]
 
-        if float(lst_h2_d2_a[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_A: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    fluid_h2_d2_a, lst_h2_d2_a[0], lst_h2_d2_a[1], H2_D2_percent_a
-                )
+        if round(lst_h2_d2_a[1], 2) != 0:
+            report.append(
+                f"{fluid_h2_d2_a}_A: measured flow is {lst_h2_d2_a[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_h2_d2_a[1]:.2f} sccm. Concentration is {H2_D2_percent_a:.1f}%"
             )
 
-        if float(lst_h2_d2_b[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_B: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    fluid_h2_d2_b, lst_h2_d2_b[0], lst_h2_d2_b[1],H2_D2_percent_b
-                )
+        if round(lst_h2_d2_b[1], 2) != 0:
+            report.append(
+                f"{fluid_h2_d2_b}_B: measured flow is {lst_h2_d2_b[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_h2_d2_b[1]:.2f} sccm. Concentration is {H2_D2_percent_b:.1f}%"
             )
 
-        if float(lst_o2_a[1]) == 0:
-            pass
-        else:
-            print(
-                "O2_A: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    lst_o2_a[0], lst_o2_a[1], O2_percent_a
-                )
+        if round(lst_o2_a[1], 2) != 0:
+            report.append(
+                f"O2_A: measured flow is {lst_o2_a[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_o2_a[1]:.2f} sccm. Concentration is {O2_percent_a:.1f}%"
             )
 
-        if float(lst_o2_b[1]) == 0:
-            pass
-        else:
-            print(
-                "O2_B: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    lst_o2_b[0], lst_o2_b[1], O2_percent_b
-                )
+        if round(lst_o2_b[1], 2) != 0:
+            report.append(
+                f"O2_B: measured flow is {lst_o2_b[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_o2_b[1]:.2f} sccm. Concentration is {O2_percent_b:.1f}%"
             )
 
-        if float(lst_co_co2_a[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_A: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    fluid_co_co2_a, lst_co_co2_a[0], lst_co_co2_a[1], CO_CO2_percent_a
-                )
+        if round(lst_co_co2_a[1], 2) != 0:
+            report.append(
+                f"{fluid_co_co2_a}_A: measured flow is {lst_co_co2_a[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_co_co2_a[1]:.2f} sccm. Concentration is {CO_CO2_percent_a:.1f}%"
             )
 
-        if float(lst_co_co2_b[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_B: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    fluid_co_co2_b, lst_co_co2_b[0], lst_co_co2_b[1], CO_CO2_percent_b
-                )
+        if round(lst_co_co2_b[1], 2) != 0:
+            report.append(
+                f"{fluid_co_co2_b}_B: measured flow is {lst_co_co2_b[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_co_co2_b[1]:.2f} sccm. Concentration is {CO_CO2_percent_b:.1f}%"
             )
 
-        if float(lst_hc_a[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_A: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    fluid_hc_a, lst_hc_a[0], lst_hc_a[1], HC_percent_a
-                )
+        if round(lst_hc_a[1], 2) != 0:
+            report.append(
+                f"{fluid_hc_a}_A: measured flow is {lst_hc_a[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_hc_a[1]:.2f} sccm. Concentration is {HC_percent_a:.1f}%"
             )
 
-        if float(lst_hc_b[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_B: measured flow is {} sccm. Flow setpoint is {} sccm. Concentration is {}%".format(
-                    fluid_hc_b, lst_hc_b[0], lst_hc_b[1], HC_percent_b
-                )
+        if round(lst_hc_b[1], 2) != 0:
+            report.append(
+                f"{fluid_hc_b}_B: measured flow is {lst_hc_b[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_hc_b[1]:.2f} sccm. Concentration is {HC_percent_b:.1f}%"
             )
 
-        if float(lst_carrier_a[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_A: measured flow is {} sccm. Flow setpoint is {} sccm".format(
-                    fluid_carrier_a, lst_carrier_a[0], lst_carrier_a[1]
-                )
+        if round(lst_carrier_a[1], 2) != 0:
+            report.append(
+                f"{fluid_carrier_a}_A: measured flow is {lst_carrier_a[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_carrier_a[1]:.2f} sccm"
             )
 
-        if float(lst_carrier_b[1]) == 0:
-            pass
-        else:
-            print(
-                "{}_B: measured flow is {} sccm. Flow setpoint is {} sccm".format(
-                    fluid_carrier_b, lst_carrier_b[0], lst_carrier_b[1]
-                )
+        if round(lst_carrier_b[1], 2) != 0:
+            report.append(
+                f"{fluid_carrier_b}_B: measured flow is {lst_carrier_b[0]:.2f} sccm. "
+                f"Flow setpoint is {lst_carrier_b[1]:.2f} sccm"
             )
 
-        print("Total flow line A: {} sccm".format(total_flow_a))
-
-        print("Total flow line B: {} sccm".format(total_flow_b))
-
-        print("-----------------------")
-        print("--- Pressure Report ---")
-        print("-----------------------")
-
-        print("Pressure in line A: {} psia".format(lst_p_a[0]))
-
-        print("Pressure in line B: {} psia".format(lst_p_b[0]))
-
-        print("------------------------------------------------------------")
-        # return lst_p_a[0], lst_p_b[0]
+        report += [
+            f"Total flow line A: {total_flow_a:.2f} sccm",
+            f"Total flow line B: {total_flow_b:.2f} sccm",
+            "-----------------------",
+            "--- Pressure Report ---",
+            "-----------------------",
+            f"Pressure in line A: {pressure_a:.2f} psia",
+            f"Pressure in line B: {pressure_b:.2f} psia",
+            "------------------------------------------------------------",
+        ]
+        print("\n".join(report))
+        # return pressure_a, pressure_b
 
     def get_pv_loop1(self):
         """Return the process value (PV) for loop1."""
-        pv = self.tmp_master.read_register(2, 1)
+        with self._tmp_lock:
+            pv = self.tmp_master.read_register(2, 1)
         print("PV = {} degC".format(pv))
     
-    def heating_event(self, rate_sp = None, sp = None):
-        """Loops over actual temperature in an heating event until setpoint is reached"""
-        print('Starting heating event:')
-        try:
-            print('Heating rate: {} C/min'.format(rate_sp))
+    @_with_retry()
+    def _safe_read(self, address, decimals=0, count=1):
+        """Reads registers of the temperature controller over its persistent connection
+        The port is only reopened when the connection itself is lost, once, before the read is retried.
+        Failed reads (no or invalid response) are retried with a backoff, the error is raised after 5 attempts
+
+        Args:
+            address (int): Address of the (first) register
+            decimals (int): Number of decimals of the register, only for a single register [default: 0]
+            count (int): Number of consecutive registers to read, they are returned raw in a list [default: 1]
+
+        Returns:
+            float | int | list[int]: Value of the register, or values of the registers when count > 1
+        """
+        with self._tmp_lock:
+            for attempt in range(2):
+                try:
+                    if count == 1:
+                        return self.tmp_master.read_register(address, decimals)
+                    return self.tmp_master.read_registers(address, count)
+                except (ConnectionError, self._serial.SerialException):
+                    if attempt:
+                        raise
+                    self.tmp_master.serial.close()
+                    self.tmp_master.serial.open()
+
+    def _read_loop_status(self):
+        """Reads the reactor temperature, the programmer temperature and the output power of the temperature controller
+        Registers 1 to 5 are read in a single Modbus transaction and the output power (register 85) in a second one.
+        The registers hold their value with one decimal, they are returned raw so that they are compared as integers
+
+        Returns:
+            tuple[int, int, int]: Reactor temperature, programmer temperature (in 0.1 C) and output power (in 0.1 %)
+        """
+        registers = self._safe_read(1, count=5)
+        return registers[0], registers[4], self._safe_read(85)
+
+    def _ramp(self, *, op, sp_reg, rate_reg, rate_sp, sp, label):
+        """Writes the rate and the setpoint of a temperature event and loops over the actual temperature until the setpoint is reached
+        The live display is refreshed every second while op(temperature, setpoint) holds
+
+        Args:
+            op (callable): Comparison that holds while the setpoint is not reached, operator.lt to heat or operator.gt to cool
+            sp_reg (int): Register of the setpoint
+            rate_reg (int): Register of the heating/cooling rate
+            rate_sp (float): Heating/cooling rate in C/min, None to keep the current rate
+            sp (float): Setpoint in C, None to return without waiting
+            label (str): Name of the event in the messages (heating or cooling)
+        """
+        print('Starting {} event:'.format(label))
+        print('{} rate: {} C/min'.format(label.capitalize(), rate_sp))
+        if rate_sp is not None:
             rate_sp = float(rate_sp)
-            self.tmp_master.write_register(35, rate_sp, 1)
-        except:
-            rate_sp = None      
+            with self._tmp_lock:
+                self.tmp_master.write_register(rate_reg, rate_sp, 1)
+        print('Setpoint: {} C'.format(sp))
+        if sp is None:
+            # Without a setpoint there is nothing to wait for
+            return
+        sp = float(sp)
+        with self._tmp_lock:
+            self.tmp_master.write_register(sp_reg, sp, 1)
+        # Attribute lookups are bound to locals once, outside of the loop
+        submit = self._io.submit
+        read_loop_status = self._read_loop_status
+        read_pressures = self.flowsms_status_pair
+        # Setpoint in the 0.1 C units of the raw temperature registers
+        sp_scaled = int(round(sp * 10))
+        next_tick = time.monotonic() + 1.0
+        loop_status = None
         try:
-            print('Setpoint: {} C'.format(sp))
-            sp = float(sp)
-            self.tmp_master.write_register(24, sp, 1)
-        except:
-            sp = None      
-        while True:
-            try:
-                temp_tc = self.tmp_master.read_register(1, 1)
-                temp_programmer = self.tmp_master.read_register(5, 1)
-                power_out = self.tmp_master.read_register(85, 1)
-            except IOError:
-                continue
-                # print("Failed to read from instrument")
-            except ValueError:
-                continue
-                # print("Instrument response is invalid")
-            try:
-                result = float(temp_tc) < float(sp)
-                if result == True:
-                    temp_tc = float(temp_tc)
-                    pressure_a = self.flowsms_status()
-                    pressure_b = self.flowsms_status()
-                    print("-----------------------------------------------------------------------------------------------------")
-                    print(f"Pressure in line A: {pressure_a} psia")
-                    print(f"Pressure in line B: {pressure_b} psia")
-                    print(f"Setpoint Temp: {sp} C | Programmer Temp: {temp_programmer} C | Reactor Temp: {temp_tc} C | Power out: {power_out}%")
-                    print("-----------------------------------------------------------------------------------------------------")
-                    print("\033[F\033[F\033[F\033[F\033[F", end="")
-                    time.sleep(1)
+            while True:
+                # The temperature controller is read by the Modbus worker while the pressures are read on the Flow-SMS bus
+                loop_status = submit(read_loop_status)
+                pressure_a, pressure_b = read_pressures()
+                temp_tc, temp_programmer, power_out = _wait_result(loop_status)
+                if op(temp_tc, sp_scaled):
+                    _write_stdout(_TICK_FMT % (pressure_a, pressure_b, sp, temp_programmer / 10, temp_tc / 10, power_out / 10))
+                    next_tick = _wait_tick(next_tick)
                 else:
+                    _write_stdout(_CLEAR_BLOCK)
                     print('{} C setpoint reached!'.format(sp))
                     break
-            except TypeError:
-                continue
-      
-        
+        finally:
+            # A read left pending by an exception (e.g. Ctrl-C or a Flow-SMS IOError) is cancelled, or finished
+            # if it already started, before the temperature controller is used again
+            if loop_status is not None and not loop_status.cancel():
+                futures_wait((loop_status,))
+
+    def heating_event(self, rate_sp = None, sp = None):
+        """Loops over actual temperature in an heating event until setpoint is reached"""
+        self._ramp(op=operator.lt, sp_reg=24, rate_reg=35, rate_sp=rate_sp, sp=sp, label="heating")
+
     def cooling_event(self, rate_sp = None, sp = None):
         """Loops over actual temperature in an cooling event until setpoint is reached"""
-    
-        print('Starting cooling event:')
-        try:
-            print('Heating rate: {} C/min'.format(rate_sp))
-            rate_sp = float(rate_sp)
-            self.tmp_master.write_register(35, rate_sp, 1)
-        except:
-            rate_sp = None      
-        try:
-            print('Setpoint: {} C'.format(sp))
-            sp = float(sp)
-            self.tmp_master.write_register(2, sp, 1)
-        except:
-            sp = None      
-        while True:
-            try:
-                temp_tc = self.tmp_master.read_register(1, 1)
-                temp_programmer = self.tmp_master.read_register(5, 1)
-                power_out = self.tmp_master.read_register(85, 1)
-            except IOError:
-                continue
-                # print("Failed to read from instrument")
-            except ValueError:
-                continue
-                # print("Instrument response is invalid")
-            try:
-                result = float(temp_tc) > float(sp)
-                if result == True:
-                    temp_tc = float(temp_tc)
-                    sp = float(sp)
-                    pressure_a = self.flowsms_status()
-                    pressure_b = self.flowsms_status()
-                    print("-----------------------------------------------------------------------------------------------------")
-                    print(f"Pressure in line A: {pressure_a} psia")
-                    print(f"Pressure in line B: {pressure_b} psia")
-                    print(f"Setpoint Temp: {sp} C | Programmer Temp: {temp_programmer} C | Reactor Temp: {temp_tc} C | Power out: {power_out}% ---")
-                    print("-----------------------------------------------------------------------------------------------------")
-                    print("\033[F\033[F\033[F\033[F\033[F", end="")                    
-                    time.sleep(1)
-                else:
-                    print('{} C setpoint reached!'.format(sp))
-                    break
-            except TypeError:
-                continue
-        
+        self._ramp(op=operator.gt, sp_reg=2, rate_reg=35, rate_sp=rate_sp, sp=sp, label="cooling")
+
     def temperature_ramping_event(self,rate_sp = None, sp = None ):
-        while True:
-            try:
-                temp_pv = self.tmp_master.read_register(289, 1) 
-            except IOError:
-                continue
-                # print("Failed to read from instrument")
-            except ValueError:
-                continue
-                # print("Instrument response is invalid")
-            try:
-                result = float(temp_pv) > float(sp)
-                if result == True:
-                    self.cooling_event(rate_sp, sp)
-                    print('start cooling event')
-                    break
-                else:
-                    self.heating_event(rate_sp, sp)
-                    print('start heating event')
-                    break
-            except TypeError:
-                continue
+        """Runs a cooling or a heating event to the setpoint depending on the current temperature"""
+        if sp is None:
+            # Without a setpoint there is nothing to ramp to
+            return
+        sp = float(sp)
+        # Raw temperature (0.1 C) compared to the setpoint in the same units
+        if self._safe_read(289) > int(round(sp * 10)):
+            self.cooling_event(rate_sp, sp)
+            print('start cooling event')
+        else:
+            self.heating_event(rate_sp, sp)
+            print('start heating event')
 
     def setpoint_finish_experiment(self):
         """Loops over actual temperature in an cooling event until setpoint is reached"""
@@ -1712,15 +2088,17 @@ class GasControl:
         try:
             print('cooling rate: {} C/min'.format(rate_sp))
             rate_sp = float(rate_sp)
-            self.tmp_master.write_register(35, rate_sp, 1)
-        except:
+            with self._tmp_lock:
+                self.tmp_master.write_register(35, rate_sp, 1)
+        except (ValueError, TypeError, IOError):
             rate_sp = None
       
         try:
             print('Setpoint: {} C'.format(sp))
             sp = float(sp)
-            self.tmp_master.write_register(24, sp, 1)
-        except:
+            with self._tmp_lock:
+                self.tmp_master.write_register(24, sp, 1)
+        except (ValueError, TypeError, IOError):
             sp = None
       
     def time_event(self, time_in_seconds: int, argument: str):
@@ -1729,20 +2107,16 @@ class GasControl:
         Args:
             time_in_seconds (int): The time to wait in seconds.
         """
-        start_time = time.time()
+        start_time = time.monotonic()
+        next_tick = start_time + 1.0
         while True:
-            elapsed_time = time.time() - start_time
+            elapsed_time = time.monotonic() - start_time
             if elapsed_time < time_in_seconds:                
-                pressure_a = self.flowsms_status()
-                pressure_b = self.flowsms_status()
-                print("-----------------------------------------------------------------------------------------------------")
-                print(f"Pressure in line A: {pressure_a} psia")
-                print(f"Pressure in line B: {pressure_b} psia")
-                print(f"Elapsed time for {str(argument)}: {int(elapsed_time)} seconds")
-                print("-----------------------------------------------------------------------------------------------------")
-                print("\033[F\033[F\033[F\033[F\033[F", end="")
-                time.sleep(1)
+                pressure_a, pressure_b = self.flowsms_status_pair()
+                _write_stdout(_ELAPSED_FMT % (pressure_a, pressure_b, argument, elapsed_time))
+                next_tick = _wait_tick(next_tick)
             else:
+                _write_stdout(_CLEAR_BLOCK)
                 print("-----------------------------------------------------------------------------------------------------\n",
                 f"Wait time of {time_in_seconds} seconds completed.",
                 "-------------------------------------------------------------------\n",
@@ -1753,81 +2127,144 @@ class GasControl:
     
     ## Remote Triggering
     def DRIFTS_PID(self):    
-        self.tmp_master.write_register(6, 86.92)
-        self.tmp_master.write_register(8, 95.52)
-        self.tmp_master.write_register(9, 15.92)
-        p=self.tmp_master.read_register(6, 2)
-        i=self.tmp_master.read_register(8, 2)
-        d=self.tmp_master.read_register(9, 2)    
+        # The PID registers hold integers, write_register truncated 86.92, 95.52 and 15.92 to these values.
+        # Registers 8 and 9 are contiguous and written in one transaction, register 7 is left untouched
+        with self._tmp_lock:
+            self.tmp_master.write_register(6, 86)
+            self.tmp_master.write_registers(8, [95, 15])
+            p, _, i, d = (value / 100 for value in self.tmp_master.read_registers(6, 4))
         print("PID for DRIFTS cell is imported" + " ,proportional band={}".format(p) + " , integral time={}".format(i) + ", derivative time={}".format(d) + ", please switch output to LOCAL")
    
     def Clausen_Cell_PID(self):    
-        self.tmp_master.write_register(6, 600)
-        self.tmp_master.write_register(8, 20)
-        self.tmp_master.write_register(9, 4)
-        p=self.tmp_master.read_register(6)
-        i=self.tmp_master.read_register(8)
-        d=self.tmp_master.read_register(9)    
+        # Registers 8 and 9 are contiguous and written in one transaction, register 7 is left untouched
+        with self._tmp_lock:
+            self.tmp_master.write_register(6, 600)
+            self.tmp_master.write_registers(8, [20, 4])
+            p, _, i, d = self.tmp_master.read_registers(6, 4)
         print("PID for Clausen cell is imported" + " ,proportional band={}".format(p) + ", integral time={}".format(i) + ", derivative time={}".format(d) + ", please switch output to AUX")
   
-    def MS_ON(self):
-        """Sends a logic value (0 or 1) to perform remote digital triggering to RlyAA"""
-        self.tmp_master.write_register(363, 0)
-        time.sleep(10)
+    def _wait_for_reg(self, address, expected, timeout=10.0, poll=0.05):
+        """Waits until a register of the temperature controller reads the expected value
+        The register is polled with a delay growing from poll up to 0.5 s
+
+        Args:
+            address (int): Address of the register
+            expected (int): Value to wait for
+            timeout (float): Maximum waiting time in seconds [default: 10.0]
+            poll (float): Initial delay between the reads in seconds [default: 0.05]
+
+        Returns:
+            bool: True if the register reached the expected value, False if the timeout expired
+        """
+        deadline = time.monotonic() + timeout
+        while self._safe_read(address) != expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll, remaining))
+            poll = min(poll * 1.5, 0.5)
+        return True
+
+    def MS_ON(self, ack_reg=None, ack_value=1):
+        """Sends a logic value (0 or 1) to perform remote digital triggering to RlyAA
+        Without an acknowledgement register it waits 10 s for the MS sequence to start
+
+        Args:
+            ack_reg (int): Register reporting the state of the MS sequence, None to wait 10 s [default: None]
+            ack_value (int): Value of ack_reg once the MS sequence started, waited for at most 10 s [default: 1]
+        """
+        with self._tmp_lock:
+            self.tmp_master.write_register(363, 0)
+        if ack_reg is None:
+            time.sleep(10)
+        elif not self._wait_for_reg(ack_reg, ack_value):
+            print('MS sequence not acknowledged after 10 s')
         print('MS sequence started')
     
-    def MS_OFF(self):
-        """Sends a logic value (0 or 1) to perform remote digital triggering to RlyAA"""
-        self.tmp_master.write_register(363, 1)
-        time.sleep(10)
+    def MS_OFF(self, ack_reg=None, ack_value=0):
+        """Sends a logic value (0 or 1) to perform remote digital triggering to RlyAA
+        Without an acknowledgement register it waits 10 s for the MS sequence to stop
+
+        Args:
+            ack_reg (int): Register reporting the state of the MS sequence, None to wait 10 s [default: None]
+            ack_value (int): Value of ack_reg once the MS sequence stopped, waited for at most 10 s [default: 0]
+        """
+        with self._tmp_lock:
+            self.tmp_master.write_register(363, 1)
+        if ack_reg is None:
+            time.sleep(10)
+        elif not self._wait_for_reg(ack_reg, ack_value):
+            print('MS sequence not acknowledged after 10 s')
         print('MS sequence stopped')
     
+    def _write_trigger(self, value):
+        """Writes the logic A trigger register (376), skipped when it already holds the value
+
+        Args:
+            value (int): Value of the trigger register
+        """
+        with self._tmp_lock:
+            if self._reg376_cache != value:
+                self.tmp_master.write_register(376, value)
+                self._reg376_cache = value
+
     def IR_ON(self):
         """Sends 5V to perform remote triggering to logic A"""    
-        self.tmp_master.write_register(376, 5)
+        self._write_trigger(5)
         time.sleep(1)
-        self.tmp_master.write_register(376, 0)
+        self._write_trigger(0)
         print('IR data acquisition started')
-        now = datetime.now()
-        dt_start = now.strftime("%m/%d/%Y %H:%M:%S")
+        dt_start = time.strftime(_TS_FMT)
         print('\ndate and time =', dt_start)
     
     def pulse_ON(self):
         """Sends 5V to perform remote triggering to logic A"""    
-        self.tmp_master.write_register(376, 3)
+        self._write_trigger(3)
         #sleep(1)
         #self.write_register(376, 0)
         print('Pulse ON')
-        now = datetime.now()
-        dt_start = now.strftime("%m/%d/%Y %H:%M:%S")
+        dt_start = time.strftime(_TS_FMT)
         print('\ndate and time =', dt_start)
     
     def pulse_OFF(self):
         """Sends 5V to perform remote triggering to logic A"""    
-        self.tmp_master.write_register(376, 0)
+        self._write_trigger(0)
         #sleep(1)
         #self.write_register(376, 0)
         print('Pulse OFF')
-        now = datetime.now()
-        dt_start = now.strftime("%m/%d/%Y %H:%M:%S")
+        dt_start = time.strftime(_TS_FMT)
         print('\ndate and time =', dt_start)
     
-    def IR_STATUS(self):
-        """Sends 5V to perform remote triggering to logic A"""    
+    def IR_STATUS(self, timeout=3600.0):
+        """Waits until the IR data acquisition reports it is finished (register 361 set to 1)
+        The register is polled with a delay growing from 0.1 s to 1 s, reset when its value changes
+
+        Args:
+            timeout (float): Maximum waiting time in seconds [default: 3600.0]
+
+        Returns:
+            bool: True when the IR data acquisition finished, False if the timeout expired
+        """
+        # Attribute and global lookups are bound to locals once, outside of the polling loop
+        read = self._safe_read
+        sleep = time.sleep
+        monotonic = time.monotonic
+        deadline = monotonic() + timeout
+        attempt = 0
+        last_result = None
         while True:
-            try:
-                result = self.tmp_master.read_register(361)
-            except IOError:
-                continue
-                # print("Failed to read from instrument")
-            except ValueError:
-                continue
-                # print("Instrument response is invalid")
+            result = read(361)
             if result == 1:
-                break
-            elif result == 0:
-                time.sleep(0.1)
-                continue
+                return True
+            if result != last_result:
+                attempt = 0
+                last_result = result
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                print('IR data acquisition not finished after {} s'.format(timeout))
+                return False
+            sleep(min(0.1 * 1.5**attempt, 1.0, remaining))
+            attempt += 1
 
 
 if __name__ == "__main__":